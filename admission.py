@@ -0,0 +1,347 @@
+# admission.py
+"""
+Kiểm soát tải đầu vào (admission control) cho các endpoint nặng:
+
+- Mỗi nhóm endpoint (generate, agent, translate, extract, light) có giới hạn số request
+  chạy đồng thời và một hàng đợi có giới hạn. Hàng đợi đầy thì từ chối ngay với 503
+  + Retry-After (ước lượng từ thời gian xử lý trung bình) thay vì để request dồn lại.
+- Giới hạn tốc độ theo client (token bucket theo IP; sau proxy thì lấy địa chỉ do proxy tin cậy
+  ghi vào X-Forwarded-For, không lấy phần client tự gửi): vượt quá thì trả 429 + Retry-After.
+  Frontend (Streamlit) gọi thay cho mọi người dùng từ cùng một IP nên được giới hạn theo phiên
+  người dùng (X-Client-Id) khi gửi đúng X-Frontend-Token. Mặc định giới hạn này chỉ bật khi
+  đã đặt ADMISSION_FRONTEND_TOKEN (hoặc đặt ADMISSION_CLIENT_RPM tường minh).
+- Mỗi request có deadline: header X-Request-Timeout (giây, tối đa ADMISSION_MAX_TIMEOUT_S)
+  hoặc timeout mặc định của nhóm. Deadline được truyền qua contextvar tới phần sinh (max_time,
+  chọn profile) và các lời gọi upstream (Serper, Gemini); hết deadline mà response chưa bắt
+  đầu thì huỷ xử lý và trả 504. Response đã bắt đầu (SSE, NDJSON) thì không bị cắt ngang.
+- Endpoint batch không có deadline cho cả request: mỗi phần tử có deadline riêng (run_item),
+  phần tử quá hạn trả lỗi của riêng nó.
+- Client ngắt kết nối thì huỷ ngay phần xử lý còn lại (task, bộ gom lô, model.generate)
+  để nhường tài nguyên cho các request còn đang chờ.
+"""
+import asyncio
+import contextvars
+import hmac
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+from rate_limit import AsyncTokenBucket
+
+# Nhóm endpoint -> (số request chạy đồng thời, số request chờ tối đa, timeout mặc định giây)
+DEFAULT_LIMITS = {
+    "generate": (16, 64, 120.0),
+    "agent": (8, 32, 90.0),
+    "translate": (8, 32, 180.0),
+    "process": (8, 32, 300.0),  # dịch + tóm tắt văn bản dài trong một request
+    "extract": (4, 16, 300.0),
+    "light": (32, 128, 15.0),
+}
+ENDPOINT_CLASSES = {
+    "/summarize": "generate", "/summarize_stream": "generate", "/summarize_batch": "generate",
+    "/process": "process",
+    "/agent_search": "agent",
+    "/translate": "translate", "/translate_batch": "translate",
+    "/extract_text": "extract", "/extract_text_stream": "extract",
+    "/detect_language": "light", "/detect_language_batch": "light",
+}
+# Endpoint batch: timeout của nhóm áp cho từng phần tử thay vì cả request
+BATCH_ENDPOINTS = frozenset({"/summarize_batch", "/translate_batch", "/detect_language_batch"})
+
+# Ghi đè giới hạn: "generate=16:64:120,agent=4:16" (đồng thời:hàng đợi[:timeout])
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "")
+# Số proxy tin cậy phía trước server (Cloud Run, Render...: 1). Mỗi proxy nối địa chỉ nó nhận được
+# vào cuối X-Forwarded-For nên IP client là phần tử thứ N tính từ cuối; các phần tử bên trái do
+# client tự gửi (giả mạo được). 0: dùng địa chỉ của kết nối.
+ADMISSION_TRUSTED_PROXIES = max(0, int(os.getenv("ADMISSION_TRUSTED_PROXIES", "0")))
+# Bí mật dùng chung với frontend: request có X-Frontend-Token khớp được tính theo X-Client-Id
+ADMISSION_FRONTEND_TOKEN = os.getenv("ADMISSION_FRONTEND_TOKEN", "")
+# Giới hạn theo client: số request mỗi phút và burst (<= 0: tắt). Mặc định chỉ bật khi đã đặt
+# ADMISSION_FRONTEND_TOKEN: nếu không, mọi người dùng Streamlit chung IP của frontend và chung
+# một bucket, nên bị 429 ngay khi tải vừa phải.
+ADMISSION_CLIENT_RPM = float(os.getenv("ADMISSION_CLIENT_RPM") or ("120" if ADMISSION_FRONTEND_TOKEN else "0"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "30"))
+# Header X-Request-Timeout được nâng timeout của nhóm lên tối đa ngần này giây
+ADMISSION_MAX_TIMEOUT_S = float(os.getenv("ADMISSION_MAX_TIMEOUT_S", "600"))
+# Thời gian cho phép trễ thêm sau deadline (để kịp trả bản tóm tắt đã bị cắt bởi max_time)
+ADMISSION_DEADLINE_GRACE_S = float(os.getenv("ADMISSION_DEADLINE_GRACE_S", "2.0"))
+_MAX_CLIENTS = 10_000
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+REJECTED = metrics.counter("chatbot_admission_rejected_total",
+                           "Số request bị từ chối theo nhóm endpoint và lý do (queue_full, queue_timeout, rate_limited).",
+                           ("endpoint_class", "reason"))
+CANCELLED = metrics.counter("chatbot_admission_cancelled_total",
+                            "Số request (phần tử batch) bị huỷ giữa chừng theo lý do (disconnect, deadline, item_deadline).",
+                            ("endpoint_class", "reason"))
+
+
+def current_deadline():
+    """Deadline (time.monotonic()) của request đang xử lý, hoặc None."""
+    return _deadline.get()
+
+
+def time_left(default: float = None):
+    """Số giây còn lại đến deadline của request (>= 0); default nếu request không có deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    left = max(0.0, deadline - time.monotonic())
+    return left if default is None else min(default, left)
+
+
+class EndpointClass:
+    """Giới hạn đồng thời + hàng đợi có giới hạn của một nhóm endpoint."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, timeout_s: float):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.timeout_s = timeout_s
+        self.in_flight = 0
+        self.waiting = 0
+        self.avg_service_s = None  # EWMA thời gian xử lý, để ước lượng Retry-After
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+    def full(self) -> bool:
+        return self.in_flight + self.waiting >= self.max_concurrent + self.max_queue
+
+    def try_reserve(self) -> bool:
+        """
+        Giữ chỗ ngay (không await) trước khi chờ đến lượt: request đến cùng lúc thấy được chỗ
+        của nhau nên phần vượt quá max_concurrent + max_queue bị từ chối ngay.
+        """
+        if self.full():
+            return False
+        self.waiting += 1
+        return True
+
+    def retry_after(self) -> int:
+        service = self.avg_service_s or 1.0
+        return max(1, math.ceil(service * (self.waiting + 1) / self.max_concurrent))
+
+    async def acquire(self, timeout: float) -> bool:
+        """Chờ đến lượt chạy với chỗ đã giữ bằng try_reserve; False (trả lại chỗ) nếu quá timeout."""
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self, service_s: float):
+        self.in_flight -= 1
+        self._semaphore.release()
+        self.avg_service_s = service_s if self.avg_service_s is None else 0.8 * self.avg_service_s + 0.2 * service_s
+
+    def stats(self) -> dict:
+        return {"max_concurrent": self.max_concurrent, "max_queue": self.max_queue, "timeout_s": self.timeout_s,
+                "in_flight": self.in_flight, "waiting": self.waiting,
+                "avg_service_ms": round(1000 * self.avg_service_s, 1) if self.avg_service_s else None}
+
+
+def build_classes(spec: str = ADMISSION_LIMITS) -> dict:
+    limits = dict(DEFAULT_LIMITS)
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        name, values = (s.strip() for s in part.split("=", 1))
+        if name not in limits:
+            print(f"ADMISSION_LIMITS: nhóm endpoint không tồn tại: {name}")
+            continue
+        numbers = values.split(":")
+        defaults = limits[name]
+        try:
+            limits[name] = (int(numbers[0]), int(numbers[1]) if len(numbers) > 1 else defaults[1],
+                            float(numbers[2]) if len(numbers) > 2 else defaults[2])
+        except ValueError:
+            print(f"ADMISSION_LIMITS không hợp lệ cho nhóm {name}: {values}")
+    return {name: EndpointClass(name, *values) for name, values in limits.items()}
+
+
+classes = build_classes()
+_client_buckets = OrderedDict()
+
+metrics.gauge("chatbot_admission_in_flight", "Số request đang chạy theo nhóm endpoint.", ("endpoint_class",),
+              callback=lambda: {(name, ): c.in_flight for name, c in classes.items()})
+metrics.gauge("chatbot_admission_waiting", "Số request đang chờ trong hàng đợi theo nhóm endpoint.",
+              ("endpoint_class",), callback=lambda: {(name, ): c.waiting for name, c in classes.items()})
+
+
+def client_key(scope) -> str:
+    headers = {}
+    for name, value in scope.get("headers", []):
+        if name in (b"x-forwarded-for", b"x-frontend-token", b"x-client-id"):
+            # Nhiều dòng X-Forwarded-For tương đương một dòng nối bằng dấu phẩy
+            headers[name] = headers[name] + b"," + value if name in headers else value
+    token = headers.get(b"x-frontend-token")
+    if ADMISSION_FRONTEND_TOKEN and token and hmac.compare_digest(token, ADMISSION_FRONTEND_TOKEN.encode()):
+        return "frontend:" + headers.get(b"x-client-id", b"").decode("latin-1")[:64]
+    if ADMISSION_TRUSTED_PROXIES and b"x-forwarded-for" in headers:
+        hops = [h.strip() for h in headers[b"x-forwarded-for"].decode("latin-1").split(",") if h.strip()]
+        if hops:
+            return hops[max(0, len(hops) - ADMISSION_TRUSTED_PROXIES)]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def client_bucket(key: str) -> AsyncTokenBucket:
+    bucket = _client_buckets.get(key)
+    if bucket is None:
+        bucket = _client_buckets[key] = AsyncTokenBucket(ADMISSION_CLIENT_RPM / 60.0, ADMISSION_CLIENT_BURST)
+        if len(_client_buckets) > _MAX_CLIENTS:
+            _client_buckets.popitem(last=False)
+    else:
+        _client_buckets.move_to_end(key)
+    return bucket
+
+
+def requested_timeout(scope):
+    for name, value in scope.get("headers", []):
+        if name == b"x-request-timeout":
+            try:
+                timeout = float(value)
+            except ValueError:
+                return None
+            return timeout if timeout > 0 else None
+    return None
+
+
+def stats() -> dict:
+    return {"classes": {name: c.stats() for name, c in classes.items()},
+            "client_rpm": ADMISSION_CLIENT_RPM, "tracked_clients": len(_client_buckets)}
+
+
+async def run_item(path: str, coro):
+    """
+    Chạy một phần tử của endpoint batch với deadline riêng: timeout của nhóm tính từ lúc phần
+    tử bắt đầu (qua contextvar như request thường), quá deadline + grace thì huỷ phần tử.
+    Raise asyncio.TimeoutError khi quá hạn.
+    """
+    endpoint_class = classes.get(ENDPOINT_CLASSES.get(path))
+    if endpoint_class is None:
+        return await coro
+    token = _deadline.set(time.monotonic() + endpoint_class.timeout_s)
+    try:
+        return await asyncio.wait_for(coro, endpoint_class.timeout_s + ADMISSION_DEADLINE_GRACE_S)
+    except asyncio.TimeoutError:
+        CANCELLED.inc(endpoint_class=endpoint_class.name, reason="item_deadline")
+        raise
+    finally:
+        _deadline.reset(token)
+
+
+async def _send_error(send, status: int, message: str, retry_after: int = None):
+    headers = [(b"content-type", b"application/json")]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    body = json.dumps({"result": "", "error": message}, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware áp dụng các giới hạn trên cho các endpoint trong ENDPOINT_CLASSES."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        endpoint_class = classes.get(ENDPOINT_CLASSES.get(scope.get("path"))) if scope["type"] == "http" else None
+        if endpoint_class is None:
+            await self.app(scope, receive, send)
+            return
+        name = endpoint_class.name
+
+        if ADMISSION_CLIENT_RPM > 0:
+            bucket = client_bucket(client_key(scope))
+            if not bucket.try_acquire():
+                REJECTED.inc(endpoint_class=name, reason="rate_limited")
+                await _send_error(send, 429, "Quá nhiều request từ client này. Vui lòng thử lại sau.",
+                                  max(1, math.ceil(bucket.retry_after())))
+                return
+        if not endpoint_class.try_reserve():
+            REJECTED.inc(endpoint_class=name, reason="queue_full")
+            await _send_error(send, 503, "Server đang quá tải. Vui lòng thử lại sau.", endpoint_class.retry_after())
+            return
+
+        timeout = min(requested_timeout(scope) or endpoint_class.timeout_s, ADMISSION_MAX_TIMEOUT_S)
+        deadline = None if scope.get("path") in BATCH_ENDPOINTS else time.monotonic() + timeout
+        if not await endpoint_class.acquire(timeout):
+            REJECTED.inc(endpoint_class=name, reason="queue_timeout")
+            await _send_error(send, 503, "Hết thời gian chờ trong hàng đợi. Vui lòng thử lại sau.",
+                              endpoint_class.retry_after())
+            return
+
+        started = time.monotonic()
+        token = _deadline.set(deadline)
+        try:
+            await self._run(scope, receive, send, name, deadline)
+        finally:
+            _deadline.reset(token)
+            endpoint_class.release(time.monotonic() - started)
+
+    async def _run(self, scope, receive, send, name: str, deadline):
+        """
+        Chạy app trong task riêng; huỷ task khi client ngắt kết nối, hoặc khi quá deadline mà
+        response chưa bắt đầu (deadline None: không giới hạn).
+        """
+        inbox = asyncio.Queue(maxsize=1)
+        disconnected = asyncio.Event()
+        response = {"started": False, "complete": False}
+
+        async def poll():
+            # Đọc trước các message của client để phát hiện http.disconnect ngay cả khi app không đọc
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    if inbox.empty():
+                        inbox.put_nowait(message)
+                    return
+                await inbox.put(message)
+
+        async def app_receive():
+            if disconnected.is_set() and inbox.empty():
+                return {"type": "http.disconnect"}
+            return await inbox.get()
+
+        async def app_send(message):
+            if message["type"] == "http.response.start":
+                response["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response["complete"] = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, app_receive, app_send))
+        poller = asyncio.ensure_future(poll())
+        waiter = asyncio.ensure_future(disconnected.wait())
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic()) + ADMISSION_DEADLINE_GRACE_S
+            done, _ = await asyncio.wait({app_task, waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done and response["started"]:
+                # Đang stream: không cắt ngang, các bước bên trong tự giới hạn theo deadline
+                await asyncio.wait({app_task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            # Ngắt kết nối sau khi đã gửi xong response (keep-alive đóng) thì không phải huỷ
+            if app_task.done() or response["complete"]:
+                await app_task
+                return
+
+            reason = "disconnect" if disconnected.is_set() else "deadline"
+            CANCELLED.inc(endpoint_class=name, reason=reason)
+            app_task.cancel()
+            try:
+                await app_task
+            except asyncio.CancelledError:
+                pass
+            if reason == "deadline" and not response["started"]:
+                await _send_error(send, 504, "Hết thời gian xử lý request.")
+        finally:
+            for task in (app_task, poller, waiter):
+                task.cancel()
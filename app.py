@@ -1,37 +1,131 @@
 
 # app.py
-import streamlit as st
+import hashlib
+import json
+import os
+import uuid
+
 import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
 
 #  CẤU HÌNH 
 BACKEND_URL = "https://vit5-huynh-nhu.onrender.com"
+# Timeout (giây) của một lời gọi API; cũng gửi qua header X-Request-Timeout để server huỷ sớm
+BACKEND_TIMEOUT = 300
+# Kết quả (trích xuất, nhận diện ngôn ngữ, dịch) được cache theo hash nội dung trong ngần này giây
+RESULT_TTL = 3600
+# Bí mật dùng chung với Backend: khi khớp, Backend giới hạn tốc độ theo từng phiên người dùng
+# (X-Client-Id) thay vì gộp mọi người dùng của frontend vào cùng một IP
+FRONTEND_TOKEN = os.getenv("ADMISSION_FRONTEND_TOKEN", "")
+# Tiền tố các thông báo lỗi server trả về trong trường "result" (không được cache)
+ERROR_PREFIXES = ("Lỗi:", "Lỗi dịch:", "Lỗi không xác định", "Lỗi API", "Lỗi khi tìm kiếm:")
+
+class BackendError(Exception):
+    """Lỗi do server Backend trả về (mã HTTP lỗi hoặc thông báo lỗi trong kết quả)."""
 
 # HÀM HỖ TRỢ (HELPER FUNCTIONS) 
-def call_backend_api(endpoint, json_data=None, files=None):
+@st.cache_resource
+def get_session():
+    """
+    Session HTTP dùng chung cho mọi lần chạy lại script: giữ kết nối (keep-alive, TLS) tới
+    Backend trong pool thay vì mở kết nối mới cho mỗi request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["X-Request-Timeout"] = str(BACKEND_TIMEOUT)
+    return session
+
+def content_hash(data) -> str:
+    """Hash SHA-256 của nội dung (bytes hoặc str), dùng làm khoá cache."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def client_headers():
+    """Header nhận diện phiên người dùng (session dùng chung cho mọi phiên nên gửi theo từng request)."""
+    if not FRONTEND_TOKEN:
+        return {}
+    client_id = st.session_state.setdefault("client_id", uuid.uuid4().hex)
+    return {"X-Frontend-Token": FRONTEND_TOKEN, "X-Client-Id": client_id}
+
+def post_backend(endpoint, json_data=None, files=None):
+    """
+    Gọi API tới Backend FastAPI qua session dùng chung (JSON data hoặc File upload).
+    Raise BackendError khi server trả lỗi để kết quả lỗi không bị cache.
+    """
+    response = get_session().post(f"{BACKEND_URL}/{endpoint}", json=None if files else json_data,
+                                  files=files, headers=client_headers(), timeout=BACKEND_TIMEOUT)
+    if response.status_code >= 400:
+        try:
+            error_msg = response.json().get('error') or 'Lỗi không xác định từ server'
+        except ValueError:
+            error_msg = response.text or 'Lỗi không xác định từ server'
+        if response.headers.get("Retry-After"):
+            error_msg += f" (thử lại sau {response.headers['Retry-After']} giây)"
+        raise BackendError(error_msg)
+    return response.json()
+
+def call_backend_api(func, *args):
     """
-    Hàm chung để gọi API tới Backend FastAPI.
-    Hỗ trợ cả gửi JSON data và File upload.
+    Gọi một hàm API (post_backend hoặc các hàm có cache bên dưới) và hiển thị lỗi lên
+    giao diện. Trả về None nếu lỗi.
     """
     try:
-        if files:
-            # Nếu có file.  
-            response = requests.post(f"{BACKEND_URL}/{endpoint}", files=files)
-        else:
-            response = requests.post(f"{BACKEND_URL}/{endpoint}", json=json_data)
-            
-        response.raise_for_status() 
-        return response.json()
+        return func(*args)
+    except requests.exceptions.ConnectionError:
+        st.error(" Lỗi: Không thể kết nối đến server Backend. Hãy đảm bảo FastAPI đang chạy.")
+    except BackendError as e:
+        st.error(f" Lỗi API: {e}")
+    except Exception as e:
+        st.error(f" Lỗi không xác định: {e}")
+    return None
+
+# Các hàm dưới đây được cache theo hash nội dung (tham số bắt đầu bằng "_" không được đưa
+# vào khoá cache). Hàm raise khi lỗi nên lỗi không bị cache và lần sau sẽ gọi lại server.
+@st.cache_data(ttl=RESULT_TTL, max_entries=64, show_spinner=False)
+def extract_text_cached(file_hash, file_name, file_type, _file_bytes):
+    resp = post_backend("extract_text", files={'file': (file_name, _file_bytes, file_type)})
+    return resp.get("result", "")
+
+@st.cache_data(ttl=RESULT_TTL, max_entries=256, show_spinner=False)
+def detect_language_cached(text_hash, _text):
+    return post_backend("detect_language", json_data={"text": _text})
+
+@st.cache_data(ttl=RESULT_TTL, max_entries=64, show_spinner=False)
+def translate_cached(text_hash, _text):
+    result = post_backend("translate", json_data={"text": _text}).get("result", "")
+    if not result or result.lstrip().startswith(ERROR_PREFIXES):
+        raise BackendError(result or "Không nhận được bản dịch.")
+    return result
+
+def stream_backend_api(endpoint, json_data):
+    """
+    Gọi endpoint streaming (Server-Sent Events) và trả về từng sự kiện
+    dưới dạng (event, data) ngay khi nhận được.
+    """
+    try:
+        with get_session().post(f"{BACKEND_URL}/{endpoint}", json=json_data, stream=True,
+                                headers=client_headers(), timeout=BACKEND_TIMEOUT) as response:
+            response.raise_for_status()
+            event = "message"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    event = "message"
+                    continue
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event, json.loads(line[len("data:"):].strip())
 
     except requests.exceptions.ConnectionError:
         st.error(" Lỗi: Không thể kết nối đến server Backend. Hãy đảm bảo FastAPI đang chạy.")
-        return None
-    except requests.exceptions.HTTPError:
-        error_msg = response.json().get('error', 'Lỗi không xác định từ server')
-        st.error(f" Lỗi API: {error_msg}")
-        return None
+    except requests.exceptions.HTTPError as e:
+        st.error(f" Lỗi API: {e}")
     except Exception as e:
         st.error(f" Lỗi không xác định: {e}")
-        return None
 
 #  GIAO DIỆN (UI SETUP) 
 st.set_page_config(page_title="AI Chatbot & Summarizer", page_icon="🤖", layout="centered")
@@ -66,7 +160,7 @@ agent_query = st.text_input("Nhập câu hỏi nghiên cứu:", placeholder="Ví
 if st.button("🔍  Tìm kiếm", key="btn_agent_search", type="primary"):
     if agent_query.strip():
         with st.spinner("Agent đang tìm kiếm, đọc tài liệu và tổng hợp..."):
-            response_data = call_backend_api("agent_search", json_data={"query": agent_query})
+            response_data = call_backend_api(post_backend, "agent_search", {"query": agent_query})
             
             if response_data:
                 final_response = response_data.get("result", "")
@@ -105,16 +199,17 @@ with col_file:
 #  Logic Xử lý Đầu vào 
 input_text = ""
 
-# Ưu tiên văn bản gõ, sau đó đến file upload
+# Ưu tiên văn bản gõ, sau đó đến file upload. File chỉ được gửi lên /extract_text khi nội dung
+# thay đổi (mỗi lần bấm nút Streamlit chạy lại cả script; kết quả được cache theo hash file).
 if typed_text and typed_text.strip():
     input_text = typed_text.strip()
 elif uploaded_file:
+    file_bytes = uploaded_file.getvalue()
     with st.spinner("Đang trích xuất nội dung file..."):
-        files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-        # Gọi API trích xuất file
-        resp = call_backend_api("extract_text", files=files)
-        if resp:
-            input_text = resp.get("result", "")
+        input_text = call_backend_api(extract_text_cached, content_hash(file_bytes), uploaded_file.name,
+                                      uploaded_file.type, file_bytes) or ""
+
+text_hash = content_hash(input_text) if input_text else None
 
 
 #  Logic Nút Dịch 
@@ -123,7 +218,7 @@ if translate_btn:
         st.warning(" Vui lòng nhập văn bản hoặc tải file lên trước.")
     else:
         # 1. Kiểm tra ngôn ngữ
-        lang_resp = call_backend_api("detect_language", json_data={"text": input_text})
+        lang_resp = call_backend_api(detect_language_cached, text_hash, input_text)
         
         if lang_resp and lang_resp.get("is_vietnamese"):
             st.success("Văn bản gốc đã là Tiếng Việt.")
@@ -132,10 +227,9 @@ if translate_btn:
         else:
             # 2. Gọi API Dịch
             with st.spinner("Đang dịch sang Tiếng Việt..."):
-                trans_resp = call_backend_api("translate", json_data={"text": input_text})
+                translated_text = call_backend_api(translate_cached, text_hash, input_text)
                 
-                if trans_resp:
-                    translated_text = trans_resp.get("result", "")
+                if translated_text:
                     st.subheader("🌐 Nội dung (Đã dịch)")
                     
                     if st.session_state.get("show_full"):
@@ -151,25 +245,38 @@ if trans_sum_btn:
     if not input_text:
         st.warning(" Vui lòng nhập văn bản hoặc tải file lên trước.")
     else:
-        with st.spinner("Đang xử lý (Dịch & Tóm tắt)..."):
-            text_to_summary = input_text
-            
-            # 1. Kiểm tra ngôn ngữ
-            lang_resp = call_backend_api("detect_language", json_data={"text": input_text})
-            
-            # 2. Tự động dịch 
-            if lang_resp and not lang_resp.get("is_vietnamese"):
-                trans_resp = call_backend_api("translate", json_data={"text": input_text})
-                if trans_resp:
-                    text_to_summary = trans_resp.get("result", "")
+        # Bản tóm tắt đã có của cùng văn bản và lĩnh vực được hiển thị lại ngay, không gọi server
+        summaries = st.session_state.setdefault("summaries", {})
+        summary_key = (text_hash, domain)
+        st.subheader(" Tóm tắt ")
+        if summary_key in summaries:
+            st.success(summaries[summary_key])
+        else:
+            # Nhận diện ngôn ngữ -> dịch (nếu cần) -> tóm tắt chạy trọn trên server trong một request
+            # (/process); bản tóm tắt được hiển thị dần từng đoạn khi đang sinh.
+            status_box = st.empty()
+            summary_box = st.empty()
+            summary_text = ""
+            completed = False
+            status_box.info("Đang xử lý (Dịch & Tóm tắt)...")
+            for event, payload in stream_backend_api("process", {"text": input_text, "domain": domain, "stream": True}):
+                if event == "error":
+                    st.error(f" Lỗi API: {payload.get('error', 'Lỗi không xác định từ server')}")
+                    break
+                if event == "language":
+                    if not payload.get("is_vietnamese"):
+                        status_box.info("Đang dịch sang tiếng Việt...")
+                elif event == "translation_chunk":
+                    status_box.info(f"Đang dịch sang tiếng Việt... (đã xong {payload.get('index', 0) + 1} đoạn)")
+                elif event == "translation":
+                    status_box.info("Đang tóm tắt...")
+                elif event == "done":
+                    summary_text = payload.get("result", summary_text)
+                    completed = True
                 else:
-                    text_to_summary = "" 
-            
-            # 3. Gọi API Tóm tắt
-            if text_to_summary:
-                sum_resp = call_backend_api("summarize", json_data={"text": text_to_summary, "domain": domain})
-                
-                if sum_resp:
-                    summary_text = sum_resp.get("result", "")
-                    st.subheader(" Tóm tắt ")
-                    st.success(summary_text)
\ No newline at end of file
+                    summary_text += payload.get("token", "")
+                if summary_text:
+                    summary_box.success(summary_text)
+            status_box.empty()
+            if completed and summary_text and not summary_text.lstrip().startswith(ERROR_PREFIXES):
+                summaries[summary_key] = summary_text
@@ -0,0 +1,130 @@
+# batching.py
+import asyncio
+import time
+
+from metrics import BATCH_SIZE, STAGE_LATENCY
+
+
+class MicroBatcher:
+    """
+    Bộ gom lô động (dynamic micro-batching): gom các yêu cầu đang chờ trong
+    một khoảng thời gian ngắn (max_wait_ms) hoặc đến khi đủ max_batch_size,
+    sau đó xử lý cả lô trong MỘT lần gọi process_batch và trả kết quả về
+    đúng từng người gọi.
+    cancellable=True: process_batch(items, cancelled) nhận thêm danh sách hàm cancelled[i]()
+    cho biết người gọi phần tử i đã huỷ chưa (để dừng sớm phần xử lý đang chạy).
+    """
+
+    def __init__(self, process_batch, max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 executor=None, name: str = "batcher", cancellable: bool = False):
+        self.process_batch = process_batch
+        self.cancellable = cancellable
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.executor = executor
+        self.name = name
+
+        self._queue = None
+        self._worker = None
+        self._loop = None
+
+        # Thống kê độ đầy của các lô
+        self._batches = 0
+        self._items = 0
+        self._size_hist = {}
+        self._total_wait = 0.0
+        self._total_process = 0.0
+        self._errors = 0
+
+    def _ensure_started(self):
+        """Khởi tạo hàng đợi và worker nền (lười) trên event loop đang chạy."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item):
+        """Gửi một phần tử vào hàng đợi và chờ kết quả của riêng phần tử đó."""
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        """Lấy phần tử đầu tiên rồi gom thêm cho đến khi hết cửa sổ chờ hoặc đủ lô."""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Lấy ngay những phần tử đã có sẵn trong hàng đợi
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Bỏ qua các yêu cầu mà người gọi đã huỷ trong lúc chờ
+            batch = [entry for entry in batch if not entry[1].cancelled()]
+            if not batch:
+                continue
+
+            items = [item for item, _, _ in batch]
+            args = (items, [future.cancelled for _, future, _ in batch]) if self.cancellable else (items, )
+            started = time.perf_counter()
+            try:
+                results = list(await self._loop.run_in_executor(self.executor, self.process_batch, *args))
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: process_batch trả về {len(results)} kết quả "
+                                       f"cho lô {len(batch)} phần tử.")
+            except Exception as e:
+                self._errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            finished = time.perf_counter()
+
+            size = len(batch)
+            BATCH_SIZE.observe(size, batcher=self.name)
+            for _, _, enqueued in batch:
+                STAGE_LATENCY.observe(started - enqueued, stage=f"{self.name}_queue_wait")
+            STAGE_LATENCY.observe(finished - started, stage=f"{self.name}_batch")
+            self._batches += 1
+            self._items += size
+            self._size_hist[size] = self._size_hist.get(size, 0) + 1
+            self._total_wait += sum(started - enqueued for _, _, enqueued in batch)
+            self._total_process += finished - started
+
+    def queue_depth(self) -> int:
+        """Số phần tử đang chờ trong hàng đợi (chưa vào lô nào)."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        """Thống kê độ đầy của lô: số lô, kích thước trung bình, phân bố kích thước."""
+        avg_size = self._items / self._batches if self._batches else 0.0
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self._batches,
+            "items": self._items,
+            "errors": self._errors,
+            "avg_batch_size": round(avg_size, 3),
+            "avg_fill_ratio": round(avg_size / self.max_batch_size, 3),
+            "batch_size_histogram": dict(sorted(self._size_hist.items())),
+            "avg_queue_wait_ms": round(1000.0 * self._total_wait / self._items, 3) if self._items else 0.0,
+            "avg_batch_process_ms": round(1000.0 * self._total_process / self._batches, 3) if self._batches else 0.0,
+            "queue_depth": self.queue_depth(),
+        }
@@ -0,0 +1,171 @@
+# benchmarks/compare_backends.py
+"""
+So sánh các backend suy luận (torch / int8 / onnx) với mô hình eager PyTorch:
+độ trễ, bộ nhớ và ROUGE, để chọn đánh đổi tốc độ/chất lượng có cơ sở.
+
+Cách chạy (từ thư mục gốc của repo):
+    python benchmarks/compare_backends.py --backends torch int8 onnx --data samples.jsonl --out report.json
+
+--data: file JSONL, mỗi dòng {"text": "...", "summary": "...", "domain": "..."} (summary, domain tuỳ chọn).
+Nếu không có summary tham chiếu, ROUGE được tính so với đầu ra của backend eager.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["INFERENCE_BACKEND"] = "torch"  # main tải mô hình eager làm mốc
+
+import main  # noqa: E402
+from inference_backends import build_backend  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+SAMPLE_TEXTS = [
+    "Theo Bộ Y tế, số ca mắc sốt xuất huyết trong tuần qua tăng mạnh tại nhiều tỉnh phía Nam. "
+    "Các chuyên gia khuyến cáo người dân chủ động diệt lăng quăng, ngủ màn và đến cơ sở y tế "
+    "ngay khi có triệu chứng sốt cao liên tục, đau đầu, phát ban.",
+    "Ngân hàng Nhà nước vừa công bố điều chỉnh giảm lãi suất điều hành nhằm hỗ trợ doanh nghiệp "
+    "tiếp cận vốn. Giới phân tích cho rằng động thái này sẽ giúp thúc đẩy tăng trưởng tín dụng "
+    "trong các tháng cuối năm, tuy nhiên cần theo dõi áp lực lạm phát.",
+    "Nhóm nghiên cứu tại một trường đại học trong nước đã phát triển mô hình trí tuệ nhân tạo "
+    "có khả năng tóm tắt văn bản tiếng Việt. Mô hình được huấn luyện trên hàng chục nghìn bài báo "
+    "và đạt kết quả khả quan trên các bộ dữ liệu đánh giá.",
+]
+
+
+def rss_mb():
+    """Bộ nhớ RSS hiện tại của tiến trình (MB)."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def _ngrams(tokens, n):
+    return [tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+
+def _f1(overlap, n_pred, n_ref):
+    if not overlap or not n_pred or not n_ref:
+        return 0.0
+    precision, recall = overlap / n_pred, overlap / n_ref
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_n(pred: str, ref: str, n: int) -> float:
+    pred_ng, ref_ng = _ngrams(pred.lower().split(), n), _ngrams(ref.lower().split(), n)
+    ref_counts = {}
+    for g in ref_ng:
+        ref_counts[g] = ref_counts.get(g, 0) + 1
+    overlap = 0
+    for g in pred_ng:
+        if ref_counts.get(g, 0) > 0:
+            ref_counts[g] -= 1
+            overlap += 1
+    return _f1(overlap, len(pred_ng), len(ref_ng))
+
+
+def rouge_l(pred: str, ref: str) -> float:
+    a, b = pred.lower().split(), ref.lower().split()
+    prev = [0] * (len(b) + 1)
+    for x in a:
+        cur = [0]
+        for j, y in enumerate(b):
+            cur.append(prev[j] + 1 if x == y else max(prev[j + 1], cur[j]))
+        prev = cur
+    return _f1(prev[-1], len(a), len(b))
+
+
+def load_samples(path):
+    if not path:
+        return [{"text": t, "domain": "Y tế"} for t in SAMPLE_TEXTS]
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_backend(model_like, samples, warmup: int = 1):
+    """Chạy summarize_batch (batch size 1, profile "quality") với backend đã cho; trả về (outputs, latencies_ms)."""
+    main.model = model_like
+    items = [(s["text"], s.get("domain", "Y tế"), main.resolve_adapter(s.get("domain", "Y tế")), "quality")
+             for s in samples]
+    for item in items[:warmup]:
+        main.summarize_batch([item])
+    outputs, latencies = [], []
+    for item in items:
+        started = time.perf_counter()
+        outputs.append(main.summarize_batch([item])[0])
+        latencies.append(1000 * (time.perf_counter() - started))
+    return outputs, latencies
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"])
+    parser.add_argument("--data", help="File JSONL chứa văn bản (và tóm tắt tham chiếu)")
+    parser.add_argument("--out", help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    if not main.init_model():
+        sys.exit("Không tải được mô hình tóm tắt.")
+
+    eager_model = main.model
+    samples = load_samples(args.data)
+    report = {"model_id": main.MODEL_ID, "samples": len(samples), "backends": {}}
+    eager_outputs = None
+
+    for name in args.backends:
+        rss_before = rss_mb()
+        started = time.perf_counter()
+        model_like, actual = build_backend(name, eager_model, main.tokenizer, main.MODEL_ID)
+        build_s = time.perf_counter() - started
+        if actual != name:
+            print(f"Bỏ qua backend {name} (không khả dụng).")
+            continue
+
+        outputs, latencies = run_backend(model_like, samples)
+        if name == "torch":
+            eager_outputs = outputs
+
+        scores = {"rouge1": [], "rouge2": [], "rougeL": []}
+        for i, pred in enumerate(outputs):
+            ref = samples[i].get("summary") or (eager_outputs[i] if eager_outputs else None)
+            if ref is None:
+                continue
+            scores["rouge1"].append(rouge_n(pred, ref, 1))
+            scores["rouge2"].append(rouge_n(pred, ref, 2))
+            scores["rougeL"].append(rouge_l(pred, ref))
+
+        report["backends"][name] = {
+            "build_s": round(build_s, 2),
+            "rss_mb_after_build": round(rss_mb(), 1),
+            "rss_mb_delta": round(rss_mb() - rss_before, 1),
+            "latency_ms_mean": round(statistics.mean(latencies), 1),
+            "latency_ms_p50": round(statistics.median(latencies), 1),
+            "latency_ms_max": round(max(latencies), 1),
+            **{k: round(statistics.mean(v), 4) for k, v in scores.items() if v},
+        }
+        print(f"{name}: {report['backends'][name]}")
+
+    main.model = eager_model
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main_cli()
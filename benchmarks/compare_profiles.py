@@ -0,0 +1,110 @@
+# benchmarks/compare_profiles.py
+"""
+So sánh các profile sinh tóm tắt (fast / balanced / quality / auto): độ trễ và ROUGE theo
+nhóm độ dài đầu vào, để chọn SUMMARY_PROFILE và ngưỡng SUMMARY_SHORT_INPUT_TOKENS có cơ sở.
+
+Cách chạy (từ thư mục gốc của repo):
+    python benchmarks/compare_profiles.py --profiles fast balanced quality auto --data samples.jsonl --out report.json
+
+--data: file JSONL, mỗi dòng {"text": "...", "summary": "...", "domain": "..."} (summary, domain tuỳ chọn).
+Nếu không có summary tham chiếu, ROUGE được tính so với đầu ra của profile "quality".
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from compare_backends import main, load_samples, rouge_n, rouge_l  # noqa: E402
+
+# Cận trên (token) của các nhóm độ dài đầu vào
+LENGTH_BUCKETS = (128, 256, 512)
+
+
+def length_bucket(n_tokens: int) -> str:
+    for bound in LENGTH_BUCKETS:
+        if n_tokens <= bound:
+            return f"<={bound}"
+    return f">{LENGTH_BUCKETS[-1]}"
+
+
+def run_profile(profile: str, items, warmup: int = 1):
+    """Chạy summarize_batch (batch size 1) với profile đã cho; trả về (outputs, latencies_ms)."""
+    for item in items[:warmup]:
+        main.summarize_batch([(*item, profile)])
+    outputs, latencies = [], []
+    for item in items:
+        started = time.perf_counter()
+        outputs.append(main.summarize_batch([(*item, profile)])[0])
+        latencies.append(1000 * (time.perf_counter() - started))
+    return outputs, latencies
+
+
+def summarize_group(latencies, outputs, refs) -> dict:
+    scores = {"rouge1": [], "rouge2": [], "rougeL": []}
+    for pred, ref in zip(outputs, refs):
+        if ref is None:
+            continue
+        scores["rouge1"].append(rouge_n(pred, ref, 1))
+        scores["rouge2"].append(rouge_n(pred, ref, 2))
+        scores["rougeL"].append(rouge_l(pred, ref))
+    return {
+        "samples": len(latencies),
+        "latency_ms_mean": round(statistics.mean(latencies), 1),
+        "latency_ms_p50": round(statistics.median(latencies), 1),
+        "latency_ms_max": round(max(latencies), 1),
+        "output_words_mean": round(statistics.mean(len(o.split()) for o in outputs), 1),
+        **{k: round(statistics.mean(v), 4) for k, v in scores.items() if v},
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=["fast", "balanced", "quality", "auto"])
+    parser.add_argument("--data", help="File JSONL chứa văn bản (và tóm tắt tham chiếu)")
+    parser.add_argument("--out", help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    profiles = [main.validate_profile(p) for p in args.profiles]
+    if not main.init_model():
+        sys.exit("Không tải được mô hình tóm tắt.")
+
+    samples = load_samples(args.data)
+    items = [(s["text"], s.get("domain", "Y tế"), main.resolve_adapter(s.get("domain", "Y tế"))) for s in samples]
+    buckets = [length_bucket(len(main.tokenizer(s["text"], truncation=True, max_length=main.MAX_INPUT_TOKENS)
+                                 ["input_ids"])) for s in samples]
+
+    # Chạy "quality" trước để làm tham chiếu khi không có summary
+    order = sorted(profiles, key=lambda p: p != "quality")
+    quality_outputs = None
+    if not all(s.get("summary") for s in samples) and "quality" not in order:
+        order.insert(0, "quality")
+
+    report = {"model_id": main.MODEL_ID, "samples": len(samples), "profiles": {}}
+    for profile in order:
+        outputs, latencies = run_profile(profile, items)
+        if profile == "quality":
+            quality_outputs = outputs
+        refs = [s.get("summary") or (quality_outputs[i] if quality_outputs else None) for i, s in enumerate(samples)]
+        if profile not in profiles:
+            continue
+
+        by_bucket = {}
+        for bucket in sorted(set(buckets), key=lambda b: (b.startswith(">"), int(b.lstrip("<=>")))):
+            idx = [i for i, b in enumerate(buckets) if b == bucket]
+            by_bucket[bucket] = summarize_group([latencies[i] for i in idx], [outputs[i] for i in idx],
+                                                [refs[i] for i in idx])
+        report["profiles"][profile] = {**summarize_group(latencies, outputs, refs), "by_input_tokens": by_bucket}
+        print(f"{profile}: {report['profiles'][profile]}")
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,487 @@
+# benchmarks/load_test.py
+"""
+Bộ benchmark / load test chạy hoàn toàn offline cho backend FastAPI (main.app).
+
+- Mô hình tóm tắt: T5 rất nhỏ khởi tạo ngẫu nhiên (seed cố định), dùng tokenizer
+  có sẵn trong repo (lora-lbc-fast_10k) -> không tải gì từ mạng.
+- Gemini và Serper được thay bằng bản giả lập cục bộ, có độ trễ cấu hình được và
+  chèn lỗi 429/503 theo tỉ lệ.
+- Mỗi endpoint được gọi ở các mức đồng thời cố định (qua httpx.ASGITransport,
+  trong cùng tiến trình, lifespan của app vẫn chạy); /extract_text dùng PDF/DOCX
+  được sinh ra lúc chạy.
+
+Báo cáo JSON (so sánh được giữa các commit) gồm: p50/p95/p99 độ trễ, thông lượng,
+RSS đỉnh và độ trễ event loop cho từng (endpoint, mức đồng thời).
+
+Cách chạy (từ thư mục gốc của repo):
+    python benchmarks/load_test.py --concurrency 1 4 16 --requests 32 --out load.json
+    python benchmarks/load_test.py --endpoints summarize translate --fail-429 0.05 --baseline load.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ["HF_HUB_OFFLINE"] = "1"
+os.environ.setdefault("MODEL_PRELOAD", "lazy")  # không tải mô hình thật khi import main
+os.environ.setdefault("INFERENCE_BACKEND", "torch")
+os.environ.setdefault("TRANSLATION_ROUTING", "gemini")  # dịch qua Gemini giả lập (không có mô hình dịch local offline)
+os.environ.setdefault("ADMISSION_CLIENT_RPM", "0")  # mọi request giả lập đến từ cùng một client
+os.environ.pop("RESULT_CACHE_DB", None)  # cache chỉ trong RAM, không lẫn giữa các lần chạy
+
+import httpx  # noqa: E402
+import torch  # noqa: E402
+from docx import Document  # noqa: E402
+from transformers import AutoTokenizer, T5Config, T5ForConditionalGeneration  # noqa: E402
+
+import main  # noqa: E402
+
+try:
+    import search_agent
+    from google.genai.errors import APIError
+except ImportError:
+    search_agent = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+TOKENIZER_PATH = os.path.join(ROOT, "lora-lbc-fast_10k")
+
+VI_PARAGRAPH = (
+    "Theo Bộ Y tế, số ca mắc sốt xuất huyết trong tuần qua tăng mạnh tại nhiều tỉnh phía Nam. "
+    "Các chuyên gia khuyến cáo người dân chủ động diệt lăng quăng, ngủ màn và đến cơ sở y tế "
+    "ngay khi có triệu chứng sốt cao liên tục, đau đầu, phát ban."
+)
+EN_PARAGRAPH = (
+    "According to the Ministry of Health, dengue cases rose sharply last week in several southern "
+    "provinces. Experts advise people to remove mosquito breeding sites, sleep under nets and "
+    "visit a clinic as soon as they have a persistent high fever, headache or rash."
+)
+
+
+#  Mô hình và upstream giả lập
+def build_tiny_model(seed: int = 0):
+    """T5 rất nhỏ, trọng số ngẫu nhiên nhưng tất định theo seed."""
+    torch.manual_seed(seed)
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_PATH)
+    config = T5Config(vocab_size=len(tokenizer), d_model=64, d_ff=128, num_layers=2, num_heads=2, d_kv=32,
+                      decoder_start_token_id=tokenizer.pad_token_id, pad_token_id=tokenizer.pad_token_id,
+                      eos_token_id=tokenizer.eos_token_id)
+    return T5ForConditionalGeneration(config).eval(), tokenizer
+
+
+class FaultInjector:
+    """Độ trễ (có dao động) và lỗi 429/503 ngẫu nhiên nhưng tất định theo seed."""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, fail_429: float, fail_503: float, seed: int):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_429 = fail_429
+        self.fail_503 = fail_503
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.injected = {429: 0, 503: 0}
+
+    async def __call__(self):
+        """Chờ độ trễ giả lập; trả về mã lỗi cần chèn (429/503) hoặc None."""
+        self.calls += 1
+        delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms))
+        await asyncio.sleep(delay / 1000)
+        roll = self.random.random()
+        if roll < self.fail_429:
+            code = 429
+        elif roll < self.fail_429 + self.fail_503:
+            code = 503
+        else:
+            return None
+        self.injected[code] += 1
+        return code
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "injected_429": self.injected[429], "injected_503": self.injected[503]}
+
+
+class FakeGeminiModels:
+    """Thay cho gemini_client.aio.models: "dịch" bằng cách trả lại văn bản có tiền tố."""
+
+    def __init__(self, faults: FaultInjector):
+        self.faults = faults
+
+    async def generate_content(self, model, contents, config=None):
+        code = await self.faults()
+        if code is not None:
+            status = "RESOURCE_EXHAUSTED" if code == 429 else "UNAVAILABLE"
+            raise APIError(code, {"error": {"code": code, "message": "injected", "status": status}})
+        return types.SimpleNamespace(text=f"[bản dịch] {contents}")
+
+
+def fake_serper_transport(faults: FaultInjector) -> httpx.MockTransport:
+    """Thay cho https://google.serper.dev/scholar: trả về kết quả học thuật giả."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        code = await faults()
+        if code is not None:
+            return httpx.Response(code, json={"message": "injected"})
+        query = json.loads(request.content).get("q", "")
+        organic = [{"title": f"Bài báo {i + 1} về {query}", "link": f"https://example.org/paper/{i + 1}",
+                    "snippet": VI_PARAGRAPH} for i in range(10)]
+        return httpx.Response(200, json={"organic": organic})
+
+    return httpx.MockTransport(handler)
+
+
+def install_fakes(args):
+    """Nạp mô hình nhỏ vào main và thay Gemini/Serper bằng bản giả lập. Trả về các FaultInjector."""
+    main.model, main.tokenizer = build_tiny_model(args.seed)
+    main.MODEL_ID, main.MODEL_STATUS = "tiny-random-t5@torch", "ready"
+
+    upstream = {}
+    if main.AGENT_AVAILABLE and search_agent is not None:
+        gemini = FaultInjector(args.gemini_latency_ms, args.jitter_ms, args.fail_429, args.fail_503, args.seed)
+        serper = FaultInjector(args.serper_latency_ms, args.jitter_ms, args.fail_429, args.fail_503, args.seed + 1)
+        search_agent.gemini_client = types.SimpleNamespace(aio=types.SimpleNamespace(models=FakeGeminiModels(gemini)))
+        search_agent.SERPER_API_KEY = "offline-benchmark"
+        search_agent._http_client = httpx.AsyncClient(transport=fake_serper_transport(serper))
+        # Upstream giả lập không có quota: mặc định bỏ giới hạn tốc độ (--gemini-rpm để bật lại)
+        search_agent.gemini_limiter = search_agent.AsyncTokenBucket(args.gemini_rpm / 60.0, search_agent.GEMINI_BURST)
+        upstream = {"gemini": gemini, "serper": serper}
+    return upstream
+
+
+#  Sinh file đầu vào
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(num_pages: int, lines_per_page: int = 40) -> bytes:
+    """Sinh PDF nhiều trang có lớp văn bản (font Helvetica chuẩn, không cần thư viện ngoài)."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    words = EN_PARAGRAPH.split()
+    for p in range(num_pages):
+        lines = [f"Page {p + 1} line {i + 1}: " + " ".join(words[i % 10:i % 10 + 10]) for i in range(lines_per_page)]
+        content = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        content = content.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), num_pages)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def make_docx(num_paragraphs: int) -> bytes:
+    doc = Document()
+    for i in range(num_paragraphs):
+        doc.add_paragraph(f"{i + 1}. {VI_PARAGRAPH}")
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+#  Kịch bản cho từng endpoint
+def build_scenarios(args) -> dict:
+    """
+    Tên kịch bản -> hàm tạo request thứ i: (method, url, kwargs cho httpx).
+    Mặc định mỗi request có nội dung khác nhau để đo đường xử lý thật (không trúng cache);
+    --repeat-inputs để đo đường cache.
+    """
+    def tag(i):
+        return "" if args.repeat_inputs else f"[{i}] "
+
+    vi_text = "\n\n".join([VI_PARAGRAPH] * args.paragraphs)
+    en_text = "\n\n".join([EN_PARAGRAPH] * args.paragraphs)
+    pdf_bytes = make_pdf(args.pdf_pages)
+    docx_bytes = make_docx(args.docx_paragraphs)
+
+    scenarios = {
+        "health": lambda i: ("GET", "/health", {}),
+        "detect_language": lambda i: ("POST", "/detect_language", {"json": {"text": tag(i) + en_text}}),
+        "summarize": lambda i: ("POST", "/summarize", {"json": {"text": tag(i) + vi_text}}),
+        "summarize_stream": lambda i: ("POST", "/summarize_stream", {"json": {"text": tag(i) + vi_text}}),
+        "summarize_batch": lambda i: ("POST", "/summarize_batch", {"json": [
+            {"text": f"{tag(i)}({j}) {VI_PARAGRAPH}"} for j in range(4)]}),
+        "extract_pdf": lambda i: ("POST", "/extract_text", {
+            "files": {"file": ("bench.pdf", pdf_bytes, "application/pdf")}}),
+        "extract_docx": lambda i: ("POST", "/extract_text", {"files": {"file": (
+            "bench.docx", docx_bytes, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}}),
+    }
+    if main.AGENT_AVAILABLE:
+        scenarios.update({
+            "translate": lambda i: ("POST", "/translate", {"json": {"text": tag(i) + en_text}}),
+            "process": lambda i: ("POST", "/process", {"json": {"text": tag(i) + en_text}}),
+            "agent_search": lambda i: ("POST", "/agent_search", {"json": {"query": f"{tag(i)}điều trị sốt xuất huyết"}}),
+        })
+    return scenarios
+
+
+def response_ok(response: httpx.Response) -> bool:
+    """Lỗi HTTP, lỗi trong SSE và lỗi trả về dạng chuỗi "Lỗi: ..." đều tính là lỗi."""
+    if response.status_code >= 400:
+        return False
+    content_type = response.headers.get("content-type", "")
+    if "event-stream" in content_type:
+        return "event: error" not in response.text
+    if "json" in content_type and "ndjson" not in content_type:
+        payload = response.json()
+        if isinstance(payload, dict):
+            if payload.get("error"):
+                return False
+            result = payload.get("result")
+            if isinstance(result, str) and main.is_error_text(result) and response.request.url.path != "/extract_text":
+                return False
+    return True
+
+
+#  Đo lường
+def current_rss_mb() -> float:
+    """RSS hiện tại (MB) của tiến trình, cộng cả các tiến trình con (process pool đọc file)."""
+    if psutil is not None:
+        proc = psutil.Process()
+        total = proc.memory_info().rss
+        for child in proc.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / 2**20
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+class RssSampler:
+    """Luồng nền lấy mẫu RSS định kỳ, ghi lại giá trị đỉnh kể từ lần reset gần nhất."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def reset(self):
+        self.peak = current_rss_mb()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.01):
+    """Đo độ trễ event loop: thời gian một lần sleep(interval) bị chậm hơn dự kiến."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(1000 * (time.perf_counter() - started - interval))
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "mean": round(statistics.fmean(ordered), 2), "max": round(ordered[-1], 2)}
+
+
+async def run_scenario(client, make_request, concurrency: int, total: int, rss: RssSampler) -> dict:
+    """Gửi `total` request với đúng `concurrency` request đang chạy cùng lúc."""
+    latencies, status_codes, failures = [], {}, 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for i in counter:
+            method, url, kwargs = make_request(i)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                ok = response_ok(response)
+                status = str(response.status_code)
+            except Exception as e:
+                ok, status = False, type(e).__name__
+            latencies.append(1000 * (time.perf_counter() - started))
+            status_codes[status] = status_codes.get(status, 0) + 1
+            failures += not ok
+
+    lag = []
+    rss.reset()
+    lag_task = asyncio.ensure_future(monitor_loop_lag(lag))
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - started
+    lag_task.cancel()
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": failures,
+        "status_codes": status_codes,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(total / wall, 2) if wall else None,
+        "latency_ms": percentiles(latencies),
+        "event_loop_lag_ms": percentiles(lag),
+        "peak_rss_mb": round(rss.peak, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_baseline(report: dict, baseline_path: str):
+    """In thay đổi p95 và thông lượng so với một báo cáo trước đó (ví dụ của commit cũ)."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline.get("results", [])}
+    print(f"So sánh với {baseline_path} (commit {baseline.get('meta', {}).get('commit')}):")
+    for r in report["results"]:
+        old = previous.get((r["endpoint"], r["concurrency"]))
+        if not old or not old["latency_ms"] or not r["latency_ms"]:
+            continue
+        p95, old_p95 = r["latency_ms"]["p95"], old["latency_ms"]["p95"]
+        rps, old_rps = r["throughput_rps"], old["throughput_rps"]
+        print(f"  {r['endpoint']:<18} c={r['concurrency']:<3} p95 {old_p95:>9.1f} -> {p95:>9.1f} ms "
+              f"({(p95 / old_p95 - 1) * 100 if old_p95 else 0:+.1f}%)  "
+              f"rps {old_rps:>7.2f} -> {rps:>7.2f} ({(rps / old_rps - 1) * 100 if old_rps else 0:+.1f}%)")
+
+
+async def run(args) -> dict:
+    upstream = install_fakes(args)
+    scenarios = build_scenarios(args)
+    names = args.endpoints or list(scenarios)
+    missing = [n for n in names if n not in scenarios]
+    if missing:
+        raise SystemExit(f"Không có kịch bản: {missing}. Có: {list(scenarios)}")
+
+    rss = RssSampler()
+    rss.start()
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+                for name in names:
+                    make_request = scenarios[name]
+                    # Làm nóng (nạp lazy, JIT của pool, ...) và không tính vào kết quả
+                    for i in range(args.warmup):
+                        method, url, kwargs = make_request(-1 - i)
+                        await client.request(method, url, **kwargs)
+                    for concurrency in args.concurrency:
+                        total = max(args.requests, concurrency)
+                        # Mỗi mức đồng thời dùng dải chỉ số riêng để không trúng cache của mức trước
+                        offset = len(results) * 100_000
+                        result = await run_scenario(client, lambda i: make_request(offset + i),
+                                                    concurrency, total, rss)
+                        result = {"endpoint": name, **result}
+                        results.append(result)
+                        print(f"{name:<18} c={concurrency:<3} p50={result['latency_ms'].get('p50')}ms "
+                              f"p95={result['latency_ms'].get('p95')}ms p99={result['latency_ms'].get('p99')}ms "
+                              f"rps={result['throughput_rps']} errors={result['errors']} "
+                              f"lag_p99={result['event_loop_lag_ms'].get('p99')}ms rss={result['peak_rss_mb']}MB")
+    finally:
+        rss.stop()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": vars(args),
+        },
+        "results": results,
+        "upstream": {name: faults.stats() for name, faults in upstream.items()},
+        "batching": main.summarize_batcher.stats(),
+        "cache": main.result_cache.stats(),
+        # RSS đỉnh của riêng tiến trình chính (ru_maxrss tính theo KB trên Linux)
+        "peak_rss_self_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", help="Các kịch bản cần chạy (mặc định: tất cả)")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Số request cho mỗi mức đồng thời")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--paragraphs", type=int, default=3, help="Số đoạn văn trong văn bản tóm tắt/dịch")
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--docx-paragraphs", type=int, default=200)
+    parser.add_argument("--repeat-inputs", action="store_true", help="Dùng lại cùng một đầu vào (đo đường cache)")
+    parser.add_argument("--gemini-latency-ms", type=float, default=200)
+    parser.add_argument("--serper-latency-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--fail-429", type=float, default=0.0, help="Tỉ lệ lời gọi upstream trả 429")
+    parser.add_argument("--fail-503", type=float, default=0.0, help="Tỉ lệ lời gọi upstream trả 503")
+    parser.add_argument("--gemini-rpm", type=float, default=0, help="Giới hạn tốc độ Gemini (0: không giới hạn)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Ghi báo cáo JSON ra file")
+    parser.add_argument("--baseline", help="Báo cáo JSON trước đó để so sánh")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Đã ghi báo cáo: {args.out}")
+    else:
+        print(text)
+    if args.baseline:
+        compare_with_baseline(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main_cli()
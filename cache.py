@@ -0,0 +1,304 @@
+# cache.py
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hoá văn bản trước khi băm: Unicode NFC, gộp khoảng trắng, bỏ khoảng trắng đầu/cuối."""
+    text = unicodedata.normalize("NFC", text or "")
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    return text.strip()
+
+
+def make_key(kind: str, text: str, **params) -> str:
+    """
+    Khoá nội dung (content-addressed): sha256 của loại tác vụ, văn bản đã chuẩn hoá
+    và các tham số ảnh hưởng đến kết quả (domain, model/adapter, tham số sinh, ...).
+    """
+    h = hashlib.sha256()
+    h.update(kind.encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    h.update(b"\0")
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Bộ nhớ đệm kết quả 2 tầng:
+    - Tầng RAM: LRU giới hạn theo số mục và tổng dung lượng.
+    - Tầng đĩa (tuỳ chọn): SQLite, giữ được qua các lần khởi động lại.
+    Có bộ đếm hit/miss/eviction.
+    Trong code async dùng aget/aset/astats: tầng RAM trả lời ngay, truy vấn SQLite chạy
+    trên `executor` (None = executor mặc định của event loop) để không chặn event loop.
+    """
+
+    # Số lần cập nhật last_access (khi đọc trúng tầng đĩa) được gom lại trước khi ghi
+    TOUCH_BATCH = 64
+
+    def __init__(self, max_items: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 db_path: str = None, disk_max_items: int = 100_000, executor=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.disk_max_items = disk_max_items
+        self.executor = executor
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        self.db_path = db_path
+        self._db = None
+        self._disk_writes = 0
+        self._touched = {}  # key -> last_access chưa ghi xuống đĩa
+        self._open_db()
+
+    def _open_db(self):
+        if not self.db_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Không mở được cache trên đĩa ({self.db_path}): {e}. Chỉ dùng cache trong RAM.")
+            self._db = None
+
+    def reopen(self):
+        """
+        Mở kết nối SQLite mới. Gọi trong tiến trình con sau fork: kết nối SQLite
+        không được dùng chung giữa các tiến trình (tầng đĩa vẫn dùng chung qua WAL).
+        """
+        with self._lock:
+            self._db = None
+            self._touched.clear()
+            self._open_db()
+
+    @staticmethod
+    def _size(key: str, value: str) -> int:
+        return len(key) + len(value.encode("utf-8"))
+
+    def _put_memory(self, key: str, value: str):
+        if key in self._memory:
+            self._memory_bytes -= self._size(key, self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_bytes += self._size(key, value)
+        while self._memory and (len(self._memory) > self.max_items or self._memory_bytes > self.max_bytes):
+            old_key, old_value = self._memory.popitem(last=False)
+            self._memory_bytes -= self._size(old_key, old_value)
+            self.evictions += 1
+
+    def _get_memory(self, key: str):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        return None
+
+    def _flush_touched(self):
+        """Ghi các last_access đang chờ (không commit; người gọi commit)."""
+        if self._touched:
+            self._db.executemany("UPDATE cache SET last_access = ? WHERE key = ?",
+                                 [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._get_memory(key)
+            if value is not None:
+                return value
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    # last_access chỉ dùng để chọn mục bị xoá nên không cần ghi ngay: gom lại
+                    # và ghi cùng lần set() kế tiếp (hoặc khi đủ TOUCH_BATCH mục)
+                    self._touched[key] = time.time()
+                    if len(self._touched) >= self.TOUCH_BATCH:
+                        self._flush_touched()
+                        self._db.commit()
+                    self._put_memory(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._put_memory(key, value)
+            if self._db is not None:
+                self._touched.pop(key, None)
+                self._flush_touched()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, last_access) VALUES (?, ?, ?)",
+                    (key, value, time.time()),
+                )
+                self._disk_writes += 1
+                # Chỉ kiểm tra kích thước tầng đĩa định kỳ (COUNT(*) tốn O(n))
+                count = 0
+                if self._disk_writes % 100 == 0:
+                    count = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+                if count > self.disk_max_items:
+                    # Xoá 10% mục ít được dùng gần đây nhất
+                    n = max(1, count - self.disk_max_items + self.disk_max_items // 10)
+                    self._db.execute(
+                        "DELETE FROM cache WHERE key IN "
+                        "(SELECT key FROM cache ORDER BY last_access ASC LIMIT ?)", (n,)
+                    )
+                    self.disk_evictions += n
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            disk_items = None
+            if self._db is not None:
+                disk_items = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": disk_items,
+            }
+
+    async def aget(self, key: str):
+        """Như get(); chỉ khi trượt tầng RAM mới tra SQLite trên executor."""
+        if self._db is None:
+            return self.get(key)
+        with self._lock:
+            value = self._get_memory(key)
+        if value is not None:
+            return value
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.get, key)
+
+    async def aset(self, key: str, value: str):
+        """Như set(); ghi SQLite (kèm commit) trên executor."""
+        if self._db is None:
+            return self.set(key, value)
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.set, key, value)
+
+    async def astats(self) -> dict:
+        """Như stats(); COUNT(*) trên SQLite chạy trên executor."""
+        if self._db is None:
+            return self.stats()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.stats)
+
+
+class TTLCache:
+    """Bộ nhớ đệm trong RAM có thời hạn (TTL) và giới hạn số mục theo LRU; lưu được mọi đối tượng."""
+
+    def __init__(self, ttl: float, max_items: int = 1024):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires = entry
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value):
+        if self.ttl <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "ttl_s": self.ttl,
+            "items": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi đồng thời có cùng khoá (in-flight coalescing): chỉ lời gọi đầu
+    tiên thực sự chạy, các lời gọi trùng chờ và dùng chung kết quả.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._waiters = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, func, *args, **kwargs):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            # Context rỗng: lời gọi chung không mang deadline (contextvar của admission) của người gọi
+            # đầu tiên; mỗi người chờ tự giới hạn thời gian chờ của mình, người chờ cuối cùng huỷ
+            # thì lời gọi chung bị huỷ theo
+            task = contextvars.Context().run(asyncio.ensure_future, func(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # shield: một người chờ bị huỷ không làm huỷ lời gọi chung của những người khác
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Người chờ cuối cùng cũng đã huỷ (ví dụ client ngắt kết nối): huỷ luôn lời gọi chung
+            if self._waiters.get(task) == 1 and not task.done():
+                self.abandoned += 1
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "inflight": len(self._inflight),
+                "abandoned": self.abandoned}
@@ -0,0 +1,115 @@
+# extraction.py
+# Tách riêng phần đọc file (chỉ dùng pdfplumber, python-docx và metrics; không import
+# torch/transformers) để có thể chạy trong process pool mà các tiến trình con không phải
+# tải lại mô hình.
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import deque
+
+import pdfplumber
+from docx import Document
+from docx.opc.exceptions import PackageNotFoundError
+from pdfminer.pdfparser import PDFSyntaxError
+from pdfplumber.utils.exceptions import PdfminerException
+
+from metrics import STAGE_LATENCY
+
+# Số trang PDF mỗi tác vụ trong process pool và số đoạn DOCX mỗi bản ghi stream
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "8"))
+EXTRACT_DOCX_PARAGRAPHS_PER_RECORD = int(os.getenv("EXTRACT_DOCX_PARAGRAPHS_PER_RECORD", "200"))
+# Thư mục ghi tạm file upload (mặc định: thư mục tạm của hệ thống)
+EXTRACT_SPOOL_DIR = os.getenv("EXTRACT_SPOOL_DIR") or None
+
+# Lỗi do nội dung file (hỏng, sai định dạng, không hỗ trợ), khác với lỗi của server.
+# Kiểu lỗi được giữ nguyên khi đi qua process pool nên có thể bắt ở phía gọi.
+PARSE_ERRORS = (PdfminerException, PDFSyntaxError, PackageNotFoundError, zipfile.BadZipFile, ValueError)
+
+
+def spool_to_disk(fileobj, suffix: str = "") -> str:
+    """Ghi file upload ra đĩa theo từng khối (không giữ toàn bộ trong RAM). Trả về đường dẫn."""
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=EXTRACT_SPOOL_DIR) as tmp:
+        shutil.copyfileobj(fileobj, tmp, 1 << 20)
+        return tmp.name
+
+
+def pdf_page_count(path: str) -> int:
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pdf_pages(path: str, start: int, end: int) -> list:
+    """Trích xuất văn bản các trang [start, end) (đánh số từ 0), mỗi trang một lần."""
+    texts = []
+    with pdfplumber.open(path, pages=list(range(start + 1, end + 1))) as pdf:
+        for page in pdf.pages:
+            texts.append(page.extract_text() or "")
+            # Giải phóng cache của trang để bộ nhớ không tăng theo số trang
+            page.close()
+    return texts
+
+
+def extract_docx_paragraphs(path: str) -> list:
+    doc = Document(path)
+    return [p.text for p in doc.paragraphs if p.text and p.text.strip() != ""]
+
+
+async def iter_extracted_text(path: str, filename: str, executor, first_page: int = 1,
+                              last_page: int = None, max_inflight: int = None):
+    """
+    Trích xuất văn bản từ file đã ghi ra đĩa và trả về dần từng bản ghi
+    {"pages": [đầu, cuối], "total_pages": n, "text": "..."} theo đúng thứ tự.
+    PDF được chia thành các dải trang xử lý song song trên executor (process pool);
+    chỉ tối đa max_inflight dải được xử lý cùng lúc nên bộ nhớ luôn bị chặn trên.
+    """
+    loop = asyncio.get_running_loop()
+    name = filename.lower()
+
+    if name.endswith(".pdf"):
+        total = await loop.run_in_executor(executor, pdf_page_count, path)
+        start = max(0, first_page - 1)
+
+        def submit(page_range):
+            return page_range, time.perf_counter(), loop.run_in_executor(executor, extract_pdf_pages, path, *page_range)
+
+        end = min(total, last_page or total)
+        ranges = iter([(s, min(s + EXTRACT_PAGES_PER_TASK, end)) for s in range(start, end, EXTRACT_PAGES_PER_TASK)])
+        window = max(1, max_inflight or (os.cpu_count() or 1) * 2)
+
+        pending = deque()
+        try:
+            for _ in range(window):
+                page_range = next(ranges, None)
+                if page_range is None:
+                    break
+                pending.append(submit(page_range))
+
+            while pending:
+                (s, e), submitted, future = pending.popleft()
+                pages = await future
+                # Tính từ lúc gửi vào pool (gồm cả thời gian chờ tiến trình rảnh)
+                STAGE_LATENCY.observe(time.perf_counter() - submitted, stage="extract_pdf_pages")
+                page_range = next(ranges, None)
+                if page_range is not None:
+                    pending.append(submit(page_range))
+                yield {"pages": [s + 1, e], "total_pages": total, "text": "\n".join(t for t in pages if t)}
+        finally:
+            # Client ngắt kết nối / lỗi: huỷ các dải chưa chạy
+            for _, _, future in pending:
+                future.cancel()
+
+    elif name.endswith(".docx"):
+        started = time.perf_counter()
+        paras = await loop.run_in_executor(executor, extract_docx_paragraphs, path)
+        STAGE_LATENCY.observe(time.perf_counter() - started, stage="extract_docx")
+        step = EXTRACT_DOCX_PARAGRAPHS_PER_RECORD
+        for i in range(0, len(paras), step):
+            yield {"paragraphs": [i + 1, min(i + step, len(paras))], "total_paragraphs": len(paras),
+                   "text": "\n".join(paras[i:i + step])}
+
+    else:
+        raise ValueError("Chỉ hỗ trợ file PDF hoặc DOCX.")
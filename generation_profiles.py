@@ -0,0 +1,138 @@
+# generation_profiles.py
+"""
+Các profile sinh cho tóm tắt và cách chọn profile theo tải:
+- "fast": greedy; "balanced": beam nhỏ; "quality": tham số cũ (5 beam);
+  "auto": "balanced" cho văn bản ngắn, "quality" cho văn bản dài.
+- Độ dài bản tóm tắt tỉ lệ với độ dài đầu vào (không bắt văn bản 50 token sinh 40-150 token).
+- Khi hàng đợi sâu hoặc request có ngân sách độ trễ, hạ dần xuống profile rẻ hơn,
+  dựa trên thời gian generate đo được (EWMA) của từng profile.
+"""
+import math
+import os
+import threading
+
+PROFILES = {
+    "fast": dict(num_beams=1, do_sample=False, no_repeat_ngram_size=3),
+    "balanced": dict(num_beams=2, length_penalty=1.0, no_repeat_ngram_size=3),
+    "quality": dict(num_beams=5, length_penalty=2.0),
+}
+AUTO = "auto"
+# Thứ tự từ đắt nhất đến rẻ nhất, dùng khi hạ profile
+LADDER = ("quality", "balanced", "fast")
+# Chi phí tương đối, dùng để ước lượng profile chưa có số đo từ profile đã có
+RELATIVE_COST = {"fast": 1.0, "balanced": 2.0, "quality": 5.0}
+
+SUMMARY_PROFILE = os.getenv("SUMMARY_PROFILE", AUTO)
+# "auto": đầu vào ngắn hơn ngần này token thì dùng "balanced"
+SUMMARY_SHORT_INPUT_TOKENS = int(os.getenv("SUMMARY_SHORT_INPUT_TOKENS", "256"))
+# Độ dài đầu ra: max_length = tỉ lệ * số token đầu vào, làm tròn lên bội số của 32, trong [32, 150]
+SUMMARY_MAX_LENGTH = int(os.getenv("SUMMARY_MAX_LENGTH", "150"))
+SUMMARY_MIN_LENGTH = int(os.getenv("SUMMARY_MIN_LENGTH", "40"))
+SUMMARY_LENGTH_RATIO = float(os.getenv("SUMMARY_LENGTH_RATIO", "0.5"))
+_LENGTH_STEP = 32
+# Mỗi khi hàng đợi gom lô sâu thêm ngần này phần tử thì hạ thêm một bậc profile (0: tắt)
+SUMMARY_DOWNGRADE_QUEUE_DEPTH = int(os.getenv("SUMMARY_DOWNGRADE_QUEUE_DEPTH", "16"))
+
+# Các request có deadline được gom lô theo nấc thời gian còn lại, nấc sau rộng gấp ngần này lần
+# nấc trước (1.1: các deadline trong một nhóm lệch nhau tối đa ~10%)
+SUMMARY_DEADLINE_BUCKET_RATIO = max(1.01, float(os.getenv("SUMMARY_DEADLINE_BUCKET_RATIO", "1.1")))
+
+
+def validate_profile(name: str = None) -> str:
+    """Chuẩn hoá tên profile (None -> mặc định). Raise ValueError nếu không hợp lệ."""
+    name = (name or SUMMARY_PROFILE).lower()
+    if name != AUTO and name not in PROFILES:
+        raise ValueError(f"Profile sinh không hợp lệ: {name}. Hỗ trợ: {[AUTO, *PROFILES]}")
+    return name
+
+
+def resolve_auto(profile: str, input_tokens: int) -> str:
+    if profile == AUTO:
+        return "balanced" if input_tokens < SUMMARY_SHORT_INPUT_TOKENS else "quality"
+    return profile
+
+
+def output_lengths(input_tokens: int):
+    """(max_length, min_length) cho đầu vào dài input_tokens token; đầu vào dài giữ nguyên 150/40."""
+    target = SUMMARY_LENGTH_RATIO * input_tokens
+    max_length = min(SUMMARY_MAX_LENGTH, max(_LENGTH_STEP, -(-int(target) // _LENGTH_STEP) * _LENGTH_STEP))
+    return max_length, min(SUMMARY_MIN_LENGTH, max_length // 3)
+
+
+def length_params() -> dict:
+    return {"length_ratio": SUMMARY_LENGTH_RATIO, "max_length": SUMMARY_MAX_LENGTH, "min_length": SUMMARY_MIN_LENGTH}
+
+
+def cache_params(profile: str) -> dict:
+    """Các tham số ảnh hưởng đến kết quả của profile (đưa vào khoá cache)."""
+    params = {"profile": profile, **length_params()}
+    if profile == AUTO:
+        params.update(short_input_tokens=SUMMARY_SHORT_INPUT_TOKENS, profiles=PROFILES)
+    else:
+        params.update(PROFILES[profile])
+    return params
+
+
+def deadline_bucket(deadline, now: float):
+    """
+    Nấc deadline để gom nhóm sinh (None: không có deadline). Nhóm dùng deadline MUỘN nhất
+    của nó làm max_time nên không phần tử nào bị cắt trước deadline của chính nó; phần tử
+    có deadline sớm nhất chỉ có thể trễ thêm tối đa một nấc.
+    """
+    if deadline is None:
+        return None
+    return math.ceil(math.log(max(0.01, deadline - now)) / math.log(SUMMARY_DEADLINE_BUCKET_RATIO))
+
+
+class LatencyModel:
+    """Thời gian trung bình (EWMA, giây) của một lần generate theo từng profile."""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._seconds = {}
+        self._lock = threading.Lock()
+
+    def observe(self, profile: str, seconds: float):
+        with self._lock:
+            previous = self._seconds.get(profile)
+            self._seconds[profile] = seconds if previous is None else (
+                self.alpha * seconds + (1 - self.alpha) * previous)
+
+    def estimate(self, profile: str):
+        """Ước lượng thời gian generate (giây); None nếu chưa đo được profile nào."""
+        with self._lock:
+            if profile in self._seconds:
+                return self._seconds[profile]
+            for known, seconds in self._seconds.items():
+                return seconds * RELATIVE_COST[profile] / RELATIVE_COST[known]
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {profile: round(1000 * s, 1) for profile, s in self._seconds.items()}
+
+
+def choose_profile(requested: str, budget_ms: float, queue_depth: int, max_batch_size: int,
+                   latency: LatencyModel) -> str:
+    """
+    Chọn profile thực tế cho request. Profile yêu cầu là mức trần; hạ một bậc cho mỗi
+    SUMMARY_DOWNGRADE_QUEUE_DEPTH phần tử đang chờ, rồi hạ tiếp cho đến khi thời gian
+    ước lượng (các lô phía trước + lô của request) vừa ngân sách độ trễ.
+    """
+    start = LADDER.index("quality" if requested == AUTO else requested)
+    if SUMMARY_DOWNGRADE_QUEUE_DEPTH > 0:
+        start += queue_depth // SUMMARY_DOWNGRADE_QUEUE_DEPTH
+    candidates = LADDER[min(start, len(LADDER) - 1):]
+
+    chosen = candidates[0]
+    if budget_ms:
+        batches = 1 + queue_depth // max(1, max_batch_size)
+        for candidate in candidates:
+            chosen = candidate
+            estimate = latency.estimate(candidate)
+            if estimate is None or 1000 * estimate * batches <= budget_ms:
+                break
+    # Không phải hạ bậc: giữ "auto" để văn bản ngắn vẫn dùng profile rẻ
+    if requested == AUTO and chosen == "quality":
+        return AUTO
+    return chosen
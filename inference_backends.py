@@ -0,0 +1,78 @@
+# inference_backends.py
+# Các backend suy luận CPU cho mô hình ViT5 đã merge LoRA.
+# Mọi backend trả về một đối tượng có .generate(...) tương thích transformers,
+# nên summarize_batch / stream_summary dùng được mà không cần sửa.
+#   - "torch": PyTorch eager (mặc định, như hiện tại)
+#   - "int8":  lượng tử hoá động int8 cho các lớp nn.Linear
+#   - "onnx":  ONNX Runtime encoder/decoder có KV-cache (cần optimum[onnxruntime])
+import os
+import re
+import shutil
+import torch
+
+try:
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+BACKENDS = ("torch", "int8", "onnx")
+
+# Thư mục lưu mô hình ONNX đã export (export chỉ chạy 1 lần cho mỗi model_id)
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", os.path.join("artifacts", "onnx"))
+
+
+def quantize_int8(model):
+    """Lượng tử hoá động int8 (trọng số int8, activation lượng tử hoá lúc chạy) cho nn.Linear."""
+    model = model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(model, tokenizer, model_id: str):
+    """
+    Export (hoặc nạp lại bản đã export) sang ONNX Runtime với encoder,
+    decoder và decoder-with-past (KV-cache).
+    """
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_id or "model")
+    export_dir = os.path.join(ONNX_CACHE_DIR, safe_id)
+
+    if os.path.exists(os.path.join(export_dir, "config.json")):
+        print(f"Đang nạp mô hình ONNX đã export: {export_dir}")
+        return ORTModelForSeq2SeqLM.from_pretrained(export_dir, use_cache=True)
+
+    print(f"Đang export mô hình sang ONNX (chỉ chạy lần đầu): {export_dir}")
+    staging_dir = export_dir + "_pytorch"
+    model.save_pretrained(staging_dir)
+    tokenizer.save_pretrained(staging_dir)
+    try:
+        ort_model = ORTModelForSeq2SeqLM.from_pretrained(staging_dir, export=True, use_cache=True)
+        ort_model.save_pretrained(export_dir)
+        tokenizer.save_pretrained(export_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return ort_model
+
+
+def build_backend(name: str, model, tokenizer, model_id: str = None):
+    """
+    Tạo backend suy luận theo tên. Nếu backend không khả dụng thì
+    quay về PyTorch eager. Trả về (model_like, tên backend thực tế).
+    """
+    name = (name or "torch").lower()
+    if name not in BACKENDS:
+        print(f"Backend suy luận không hợp lệ: {name}. Dùng 'torch'.")
+        return model, "torch"
+    if model is None or name == "torch":
+        return model, "torch"
+
+    try:
+        if name == "int8":
+            return quantize_int8(model), "int8"
+        if name == "onnx":
+            if not ONNX_AVAILABLE:
+                print("Thiếu optimum[onnxruntime], không dùng được backend ONNX. Dùng 'torch'.")
+                return model, "torch"
+            return export_onnx(model, tokenizer, model_id), "onnx"
+    except Exception as e:
+        print(f"Lỗi khi khởi tạo backend {name}: {e}. Dùng 'torch'.")
+    return model, "torch"
@@ -0,0 +1,100 @@
+# language_id.py
+"""
+Nhận diện ngôn ngữ nhanh và tất định.
+
+- Chỉ xét một mẫu có kích thước cố định: vài cửa sổ trải đều trên văn bản (đầu,
+  giữa, cuối), nên độ trễ không phụ thuộc độ dài tài liệu (kể cả file nhiều MB).
+- Heuristic dấu tiếng Việt: nếu mẫu đủ dài và tỉ lệ ký tự chỉ có trong tiếng Việt (ă, ơ,
+  ư, đ và các nguyên âm mang dấu thanh thuộc khối Unicode U+1EA0–U+1EF9) đủ cao thì kết
+  luận ngay là tiếng Việt mà không cần gọi langdetect. Văn xuôi tiếng Việt có khoảng
+  15–22% ký tự loại này; văn bản tiếng Anh nhắc tên người/địa danh Việt (Nguyễn Thị
+  Hương, Hà Nội...) chỉ khoảng 5% nên phải qua langdetect.
+- Trường hợp còn lại dùng langdetect với bộ profile nạp một lần và seed cố định,
+  nên cùng một văn bản luôn cho cùng một kết quả.
+"""
+import os
+import re
+import threading
+import unicodedata
+
+from langdetect.detector_factory import DetectorFactory, PROFILES_DIRECTORY
+from langdetect.lang_detect_exception import LangDetectException
+
+LANGID_SEED = int(os.getenv("LANGID_SEED", "0"))
+LANGID_WINDOWS = int(os.getenv("LANGID_WINDOWS", "3"))  # Số cửa sổ lấy mẫu
+LANGID_WINDOW_CHARS = int(os.getenv("LANGID_WINDOW_CHARS", "1000"))  # Số ký tự mỗi cửa sổ
+# Tỉ lệ ký tự đặc trưng tiếng Việt (trên tổng số chữ cái) để kết luận ngay là tiếng Việt,
+# chỉ áp dụng khi mẫu có ít nhất LANGID_VI_MIN_LETTERS chữ cái; còn lại dùng langdetect
+LANGID_VI_RATIO = float(os.getenv("LANGID_VI_RATIO", "0.12"))
+LANGID_VI_MIN_LETTERS = int(os.getenv("LANGID_VI_MIN_LETTERS", "40"))
+
+# â, ê, ô cũng có trong tiếng Pháp/Bồ Đào Nha nên không tính
+_VI_SPECIFIC = re.compile("[ăđơưĂĐƠƯẠ-ỹ]")
+_LATIN_LETTER = re.compile("[A-Za-zÀ-ɏḀ-ỿ]")
+
+_factory = None
+_factory_lock = threading.Lock()
+
+
+def get_factory() -> DetectorFactory:
+    """Nạp profile của langdetect đúng một lần (an toàn giữa các luồng), với seed cố định."""
+    global _factory
+    if _factory is None:
+        with _factory_lock:
+            if _factory is None:
+                factory = DetectorFactory()
+                factory.load_profile(PROFILES_DIRECTORY)
+                factory.seed = LANGID_SEED
+                _factory = factory
+    return _factory
+
+
+def sample_text(text: str, windows: int = LANGID_WINDOWS, window_chars: int = LANGID_WINDOW_CHARS) -> str:
+    """Lấy `windows` đoạn dài `window_chars` trải đều trên văn bản, cắt tại khoảng trắng."""
+    if len(text) <= windows * window_chars:
+        return text
+    parts = []
+    step = (len(text) - window_chars) / max(1, windows - 1)
+    for i in range(windows):
+        start = int(i * step)
+        window = text[start:start + window_chars]
+        # Bỏ từ bị cắt dở ở hai đầu cửa sổ
+        if start > 0 and " " in window:
+            window = window[window.index(" ") + 1:]
+        if start + window_chars < len(text) and " " in window:
+            window = window[:window.rindex(" ")]
+        parts.append(window)
+    return "\n".join(parts)
+
+
+def identify_language(text: str) -> dict:
+    """
+    Nhận diện ngôn ngữ của văn bản.
+    Trả về {"language": mã ngôn ngữ hoặc None, "is_vietnamese": bool,
+    "confidence": 0..1, "method": "diacritics" | "langdetect" | "too_short"}.
+    confidence: với "langdetect" là xác suất của langdetect; với "diacritics" là tỉ lệ ký tự
+    đặc trưng tiếng Việt đo được (>= LANGID_VI_RATIO), không phải xác suất.
+    """
+    # Chuẩn hoá NFC để dấu tổ hợp (thường gặp trong văn bản trích từ PDF) khớp với bảng ký tự
+    sample = unicodedata.normalize("NFC", sample_text(text or ""))
+    if len(sample.strip()) < 5:
+        return {"language": None, "is_vietnamese": False, "confidence": 0.0, "method": "too_short"}
+
+    letters = len(_LATIN_LETTER.findall(sample))
+    vi_chars = len(_VI_SPECIFIC.findall(sample))
+    ratio = vi_chars / letters if letters else 0.0
+    if letters >= LANGID_VI_MIN_LETTERS and ratio >= LANGID_VI_RATIO:
+        return {"language": "vi", "is_vietnamese": True, "confidence": round(ratio, 3), "method": "diacritics"}
+
+    try:
+        detector = get_factory().create()
+        detector.append(sample.lower())
+        probabilities = detector.get_probabilities()
+    except LangDetectException:
+        probabilities = []
+
+    if not probabilities:
+        return {"language": None, "is_vietnamese": False, "confidence": 0.0, "method": "langdetect"}
+    best = probabilities[0]
+    return {"language": best.lang, "is_vietnamese": best.lang == "vi",
+            "confidence": round(best.prob, 3), "method": "langdetect"}
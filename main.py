@@ -1,37 +1,132 @@
 # main.py(fastapi) 
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
+from typing import Optional
 import torch
-import pdfplumber
-from docx import Document
-import io
-from langdetect import detect
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, T5ForConditionalGeneration
+import asyncio
+import copy
+import functools
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from transformers import (AutoTokenizer, AutoModelForSeq2SeqLM, AsyncTextIteratorStreamer, StoppingCriteria,
+                          StoppingCriteriaList)
 import os
+import json
+import time
+from batching import MicroBatcher
+from text_chunking import chunk_text
+from cache import ResultCache, make_key
+from language_id import identify_language, get_factory
+from generation_profiles import (PROFILES, LatencyModel, validate_profile, resolve_auto, output_lengths,
+                                 cache_params, length_params, choose_profile, deadline_bucket)
+from inference_backends import build_backend
+from extraction import PARSE_ERRORS, iter_extracted_text, spool_to_disk
+import metrics
+from metrics import MetricsMiddleware, stage_timer
+from profiling import profiler, ProfilingMiddleware, PROFILING_ADMIN_TOKEN, is_admin
+import admission
+from admission import AdmissionMiddleware, current_deadline
+from model_store import load_merged_model, load_multi_adapter_model, parse_mapping, BASE_MODEL_NAME, LORA_ADAPTERS
 
-# TÍCH HỢP PEFT 
-try:
-    from peft import PeftModel
-    PEFT_AVAILABLE = True
-except ImportError:
-    PEFT_AVAILABLE = False
+PROCESS_STARTED = time.perf_counter()
 
 #  TÍCH HỢP AGENT TỪ FILE KHÁC 
 try:
-    from search_agent import rag_agent, translate_text, gemini_client
+    from search_agent import rag_agent, close_http_client, agent_cache_stats
     AGENT_AVAILABLE = True
 except ImportError:
     AGENT_AVAILABLE = False
 
+#  Dịch: backend local (CPU) và/hoặc Gemini, định tuyến theo TRANSLATION_ROUTING
+import translation
+from translation import translate_text, iter_translated_chunks, translation_available, local_translator
+
+#  Cấu hình mô hình thực thi (execution model)
+# - INFERENCE_WORKERS: luồng chạy model.generate (CPU-bound, torch tự nhả GIL)
+# - PARSE_WORKERS: tiến trình đọc PDF/DOCX (thuần Python, cần tách tiến trình)
+# - LIGHT_WORKERS: luồng cho các tác vụ nhẹ như nhận diện ngôn ngữ
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+LIGHT_WORKERS = int(os.getenv("LIGHT_WORKERS", "2"))
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+light_executor = ThreadPoolExecutor(max_workers=LIGHT_WORKERS, thread_name_prefix="light")
+
+async def run_in_pool(executor, func, *args, **kwargs):
+    """Chạy hàm chặn (blocking) trên pool riêng để không chặn event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+@asynccontextmanager
+async def lifespan(app):
+    print(f"Server sẵn sàng nhận request sau {time.perf_counter() - PROCESS_STARTED:.2f}s kể từ khi import.")
+    if MODEL_PRELOAD == "background":
+        start_model_loading()
+    # Nạp sẵn profile nhận diện ngôn ngữ (chỉ một lần) để request đầu tiên không phải chờ
+    light_executor.submit(get_factory)
+    # Nạp sẵn mô hình dịch local (nếu routing có dùng) trên pool dịch riêng
+    if MODEL_PRELOAD == "background" and translation.TRANSLATION_ROUTING != "gemini":
+        local_translator.executor.submit(local_translator.load)
+    yield
+    if AGENT_AVAILABLE:
+        await close_http_client()
+    inference_executor.shutdown(wait=False, cancel_futures=True)
+    parse_executor.shutdown(wait=False, cancel_futures=True)
+    light_executor.shutdown(wait=False, cancel_futures=True)
+    translation.shutdown()
+    _model_loader.shutdown(wait=False, cancel_futures=True)
+
 #  Khởi tạo FastAPI App 
-app = FastAPI(title="Chatbot Backend API")
+app = FastAPI(title="Chatbot Backend API", lifespan=lifespan)
+# Middleware thêm sau chạy ngoài cùng: metrics đo cả thời gian profiling
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+#  Cấu hình gom lô (micro-batching) cho /summarize
+SUMMARIZE_MAX_BATCH_SIZE = int(os.getenv("SUMMARIZE_MAX_BATCH_SIZE", "8"))
+SUMMARIZE_BATCH_WAIT_MS = float(os.getenv("SUMMARIZE_BATCH_WAIT_MS", "10"))
+
+#  Số phần tử xử lý đồng thời trong các endpoint batch (/summarize_batch, ...)
+BATCH_ENDPOINT_CONCURRENCY = int(os.getenv("BATCH_ENDPOINT_CONCURRENCY", "32"))
+
+#  Cấu hình tóm tắt văn bản dài (map-reduce)
+MAX_INPUT_TOKENS = 512
+SUMMARIZE_CHUNK_TOKENS = int(os.getenv("SUMMARIZE_CHUNK_TOKENS", "480"))  # chừa chỗ cho tiền tố domain
+SUMMARIZE_MAX_ROUNDS = int(os.getenv("SUMMARIZE_MAX_ROUNDS", "4"))
+
+#  Cache kết quả tóm tắt/dịch (RAM LRU + SQLite tuỳ chọn)
+RESULT_CACHE_MAX_ITEMS = int(os.getenv("RESULT_CACHE_MAX_ITEMS", "1024"))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "64"))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB")  # ví dụ: cache/results.sqlite3; để trống = chỉ dùng RAM
+
+result_cache = ResultCache(max_items=RESULT_CACHE_MAX_ITEMS, max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+                           db_path=RESULT_CACHE_DB, executor=light_executor)
 
 #  Model Classes
 class TextIn(BaseModel):
     text: str
     domain: str = "Y tế"
+    adapter: Optional[str] = None  # Chọn LoRA adapter cụ thể (mặc định: theo domain)
+    hierarchical: bool = True  # Tóm tắt phân cấp cho văn bản dài thay vì cắt bỏ sau 512 token
+    profile: Optional[str] = None  # fast | balanced | quality | auto (mặc định: SUMMARY_PROFILE)
+    latency_budget_ms: Optional[float] = None  # Ngân sách độ trễ: chọn profile vừa ngân sách và dừng sinh khi hết giờ
+
+class StreamIn(TextIn):
+    sampling: bool = False  # False: greedy; True: lấy mẫu top-p
+
+class ProcessIn(TextIn):
+    stream: bool = False  # True: trả về Server-Sent Events theo từng giai đoạn
+
+class ProfileConfigIn(BaseModel):
+    mode: str = "off"  # off | cprofile | torch
+    sample_rate: Optional[float] = None  # Tỉ lệ lời gọi được profile (0..1)
+    max_profiles: Optional[int] = None  # Số kết quả gần nhất được giữ lại
 
 class QueryIn(BaseModel):
     query: str
@@ -39,134 +134,925 @@ class QueryIn(BaseModel):
 class ApiResponse(BaseModel):
     result: str
     error: str = None
+    timings: Optional[dict] = None
+    cached: bool = False
+    profile: Optional[str] = None  # Profile sinh đã dùng (tóm tắt)
+
+class ProcessResponse(ApiResponse):
+    is_vietnamese: Optional[bool] = None
+    translation: Optional[str] = None  # Bản dịch (None nếu văn bản đã là tiếng Việt)
 
 class BoolResponse(BaseModel):
     is_vietnamese: bool
+    language: Optional[str] = None
+    confidence: float = 0.0
 
 #  Tải Model (Chạy 1 lần khi server khởi động) 
-def load_model():
-    model_path = r"E:\chatbotproject4\lora-lbc-fast_10k"
-    BASE_MODEL_NAME = "VietAI/vit5-base" 
-
-    if not PEFT_AVAILABLE:
-        print("Bỏ qua load model cục bộ vì thiếu thư viện peft.")
-    
-    if PEFT_AVAILABLE and os.path.exists(model_path):
+def load_model(timings: dict = None):
+    timings = {} if timings is None else timings
+    adapters = parse_mapping(LORA_ADAPTERS)
+    if len(adapters) > 1:
         try:
-            print(f"Đang tải mô hình nền tảng ({BASE_MODEL_NAME}) và LoRA adapter...")
-            tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
-            base_model = T5ForConditionalGeneration.from_pretrained(BASE_MODEL_NAME)
-            model = PeftModel.from_pretrained(base_model, model_path)
-            model = model.merge_and_unload()
-            print("Đã load model gốc và LoRA adapter thành công!")
-            return model, tokenizer
+            multi = load_multi_adapter_model(BASE_MODEL_NAME, adapters, timings)
+            if multi is not None:
+                return multi
         except Exception as e:
-            print(f"Lỗi khi load LoRA adapter: {e}. Đang chuyển sang load model online...")
+            print(f"Lỗi khi load nhiều LoRA adapter: {e}. Đang chuyển sang một adapter đã merge...")
+    try:
+        # Ưu tiên artifact đã merge sẵn; lần đầu sẽ merge LoRA rồi lưu artifact
+        if len(adapters) == 1:
+            merged = load_merged_model(adapter_path=next(iter(adapters.values())), timings=timings)
+        else:
+            merged = load_merged_model(timings=timings)
+        if merged is not None:
+            print("Đã load model gốc và LoRA adapter thành công!")
+            return merged
+    except Exception as e:
+        print(f"Lỗi khi load LoRA adapter: {e}. Đang chuyển sang load model online...")
     
     try:
         print("Đang tải model dự phòng (pengold) từ Hugging Face...")
+        started = time.perf_counter()
         tokenizer = AutoTokenizer.from_pretrained("pengold/t5-vietnamese-summarization")
         model = AutoModelForSeq2SeqLM.from_pretrained("pengold/t5-vietnamese-summarization")
+        timings["fallback_load_s"] = round(time.perf_counter() - started, 3)
         print("Đã load model từ Hugging Face!")
-        return model, tokenizer
+        return model, tokenizer, "pengold/t5-vietnamese-summarization"
     except Exception as e_online:
         print(f"Lỗi nghiêm trọng: Không thể load model tóm tắt dự phòng. Chi tiết: {e_online}")
-        return None, None
+        return None, None, None
+
+#  Backend suy luận: "torch" (eager), "int8" (lượng tử hoá động) hoặc "onnx" (ONNX Runtime)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+
+#  Chế độ tải model: "background" (tải ngay khi server khởi động, không chặn /health)
+#  hoặc "lazy" (chỉ tải khi có request đầu tiên cần model)
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "background")
+
+#  Định tuyến domain -> adapter khi chạy nhiều adapter: "Y tế=lbc,Kinh tế=vietnews"
+#  Domain không có trong bảng dùng adapter đầu tiên; "__base__" = mô hình nền không LoRA
+ADAPTER_DOMAINS = parse_mapping(os.getenv("ADAPTER_DOMAINS", ""))
+BASE_ADAPTER = "__base__"
+
+#  Model toàn cục (được gán bởi init_model)
+model, tokenizer, MODEL_ID = None, None, None
+MULTI_ADAPTER = False
+ADAPTERS = []
+MODEL_STATUS = "pending"  # pending | loading | ready | failed
+STARTUP_TIMINGS = {}
+_model_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+_model_future = None
+
+def init_model():
+    """Tải model + chọn backend suy luận (blocking), ghi lại thời gian từng bước."""
+    global model, tokenizer, MODEL_ID, INFERENCE_BACKEND, MODEL_STATUS, MULTI_ADAPTER, ADAPTERS
+    MODEL_STATUS = "loading"
+    started = time.perf_counter()
+    timings = {}
+    loaded_model, loaded_tokenizer, model_id = load_model(timings)
+    if loaded_model is None:
+        MODEL_STATUS = "failed"
+        print("CẢNH BÁO NGHIÊM TRỌNG: KHÔNG THỂ TẢI BẤT KỲ MODEL TÓM TẮT NÀO.")
+    else:
+        # Nhiều adapter chưa merge: chỉ backend PyTorch eager hỗ trợ adapter_names
+        multi = hasattr(loaded_model, "peft_config")
+        if multi and INFERENCE_BACKEND != "torch":
+            print(f"Backend {INFERENCE_BACKEND} không hỗ trợ nhiều adapter. Dùng 'torch'.")
+            INFERENCE_BACKEND = "torch"
+        MULTI_ADAPTER, ADAPTERS = multi, (list(loaded_model.peft_config) if multi else [])
 
-#  Khởi tạo Model toàn cục 
-model, tokenizer = load_model()
-if model is None:
-    print("CẢNH BÁO NGHIÊM TRỌNG: KHÔNG THỂ TẢI BẤT KỲ MODEL TÓM TẮT NÀO.")
+        backend_started = time.perf_counter()
+        loaded_model, INFERENCE_BACKEND = build_backend(INFERENCE_BACKEND, loaded_model, loaded_tokenizer, model_id)
+        timings["backend_s"] = round(time.perf_counter() - backend_started, 3)
+        model, tokenizer, MODEL_ID = loaded_model, loaded_tokenizer, f"{model_id}@{INFERENCE_BACKEND}"
+        MODEL_STATUS = "ready"
+        print(f"Backend suy luận: {INFERENCE_BACKEND}")
+    timings["model_total_s"] = round(time.perf_counter() - started, 3)
+    timings["since_process_start_s"] = round(time.perf_counter() - PROCESS_STARTED, 3)
+    STARTUP_TIMINGS.update(timings)
+    print(f"Thời gian khởi động model: {timings}")
+    return model is not None
+
+def start_model_loading():
+    """Bắt đầu tải model trên luồng nền (chỉ một lần)."""
+    global _model_future
+    if _model_future is None:
+        _model_future = _model_loader.submit(init_model)
+    return _model_future
+
+def preload_model() -> bool:
+    """
+    Tải model ngay trên luồng hiện tại (blocking). Dùng trong tiến trình cha của serve.py
+    trước khi fork worker: worker thấy model đã sẵn sàng và không tải lại.
+    """
+    global _model_future
+    _model_future = concurrent.futures.Future()
+    _model_future.set_result(init_model())
+    return _model_future.result()
+
+def reinit_after_fork():
+    """
+    Gọi trong worker vừa được fork (serve.py): tạo lại các tài nguyên không dùng chung được
+    giữa các tiến trình (pool tiến trình đọc PDF/DOCX, kết nối SQLite của cache).
+    """
+    global parse_executor
+    parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    result_cache.reopen()
+
+async def wait_for_model() -> bool:
+    """Chờ model tải xong (không chặn event loop). Trả về True nếu model dùng được."""
+    if MODEL_STATUS == "ready":
+        return True
+    return await asyncio.wrap_future(start_model_loading())
 
 #  Các hàm Logic (app.py)
-def is_vietnamese(text: str) -> bool:
-    try:
-        if len(text) < 5: return False
-        return detect(text.lower()) == "vi"
-    except:
-        return False
+DOMAIN_MAP = {
+    "Công nghệ": "summarize_cong_nghe", "Khoa học": "summarize_khoa_hoc",
+    "Y tế": "summarize_y_te", "Kinh tế": "summarize_kinh_te",
+    "Xu hướng": "summarize_xu_huong", "Xã hội": "summarize_xa_hoi"
+}
+
+# Tham số sinh cho chế độ streaming (beam search không stream được); độ dài theo output_lengths
+STREAM_GEN_KWARGS = dict(no_repeat_ngram_size=3)
+STREAM_CACHE_PARAMS = dict(STREAM_GEN_KWARGS, greedy=True, **length_params())
+
+def stream_cache_params(profile: str, hierarchical: bool) -> dict:
+    """Tham số cho khoá cache chế độ stream: bước cuối greedy, bước map (tóm tắt phân cấp) theo profile."""
+    return dict(STREAM_CACHE_PARAMS, map=cache_params(profile)) if hierarchical else STREAM_CACHE_PARAMS
+
+# Thời gian generate đo được của từng profile, dùng để chọn profile theo ngân sách độ trễ
+generation_latency = LatencyModel()
 
-def summarize_text(text, domain="Y tế"):
+def resolve_adapter(domain: str, adapter: str = None):
+    """
+    Chọn LoRA adapter cho request: tham số adapter tường minh, nếu không thì theo domain.
+    Trả về None khi server chạy một adapter đã merge. Raise ValueError nếu adapter không tồn tại.
+    """
+    if not MULTI_ADAPTER:
+        if adapter:
+            raise ValueError("Server đang chạy một adapter đã merge, không hỗ trợ chọn adapter.")
+        return None
+    name = adapter or ADAPTER_DOMAINS.get(domain) or ADAPTERS[0]
+    if name != BASE_ADAPTER and name not in ADAPTERS:
+        raise ValueError(f"Adapter không tồn tại: {name}. Các adapter khả dụng: {ADAPTERS}")
+    return name
+
+class StopWhen(StoppingCriteria):
+    """Dừng model.generate khi should_stop() trả về True (ví dụ: mọi người gọi đã huỷ)."""
+
+    def __init__(self, should_stop):
+        self.should_stop = should_stop
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0], ), bool(self.should_stop()), dtype=torch.bool, device=input_ids.device)
+
+def summarize_batch(items, cancelled=None):
+    """
+    Tóm tắt một lô văn bản, mỗi nhóm cùng tham số sinh là MỘT lần gọi model.generate.
+    items: danh sách (text, domain, adapter[, profile[, deadline]]); profile mặc định
+    SUMMARY_PROFILE, deadline (time.monotonic()) giới hạn thời gian sinh qua max_time
+    (gom nhóm theo nấc deadline, xem deadline_bucket).
+    cancelled: (tuỳ chọn, từ MicroBatcher) cancelled[i]() cho biết người gọi phần tử i đã
+    huỷ chưa; nhóm mà mọi người gọi đều đã huỷ thì bỏ qua hoặc dừng sinh giữa chừng.
+    Trả về danh sách bản tóm tắt theo đúng thứ tự.
+    Khi chạy nhiều adapter, lô có thể trộn nhiều adapter (adapter_names theo từng mẫu).
+    """
     if not model or not tokenizer:
-        return "Lỗi: Không tải được mô hình tóm tắt."
-        
-    domain_map = {
-        "Công nghệ": "summarize_cong_nghe", "Khoa học": "summarize_khoa_hoc",
-        "Y tế": "summarize_y_te", "Kinh tế": "summarize_kinh_te",
-        "Xu hướng": "summarize_xu_huong", "Xã hội": "summarize_xa_hoi"
-    }
-    prefix = domain_map.get(domain, "summarize")
+        return ["Lỗi: Không tải được mô hình tóm tắt."] * len(items)
+
+    with profiler.profile("summarize_batch"):
+        items = [tuple(item) + (None,) * (5 - len(item)) for item in items]
+        input_texts = [f"{DOMAIN_MAP.get(domain, 'summarize')}: {text}" for text, domain, *_ in items]
+        with stage_timer("tokenize"):
+            inputs = tokenizer(input_texts, max_length=MAX_INPUT_TOKENS, truncation=True, padding=True, return_tensors="pt").to("cpu")
+        lengths = inputs["attention_mask"].sum(dim=1).tolist()
+
+        # Gom theo (profile, độ dài đầu ra, nấc deadline): độ dài đã được làm tròn nên số nhóm nhỏ.
+        # Request không có deadline không chung nhóm với request có deadline (không bị cắt theo max_time)
+        groups = {}
+        now = time.monotonic()
+        for i, (_, _, _, profile, deadline) in enumerate(items):
+            profile = resolve_auto(validate_profile(profile), lengths[i])
+            groups.setdefault((profile, *output_lengths(lengths[i]), deadline_bucket(deadline, now)), []).append(i)
+
+        summaries = [None] * len(items)
+        for (profile, max_length, min_length, _), indices in groups.items():
+            if cancelled is not None:
+                def all_cancelled(group=indices):
+                    return all(cancelled[i]() for i in group)
+                if all_cancelled():
+                    continue
+            width = max(lengths[i] for i in indices)
+            gen_kwargs = dict(PROFILES[profile], max_length=max_length, min_length=min_length)
+            if cancelled is not None:
+                gen_kwargs["stopping_criteria"] = StoppingCriteriaList([StopWhen(all_cancelled)])
+            # Deadline muộn nhất của nhóm: không cắt phần tử nào trước deadline của chính nó, nên người
+            # gọi chỉ cần so với deadline của mình để biết bản tóm tắt có thể đã bị cắt (không cache)
+            deadlines = [items[i][4] for i in indices if items[i][4] is not None]
+            if deadlines:
+                gen_kwargs["max_time"] = max(0.01, max(deadlines) - time.monotonic())
+            if MULTI_ADAPTER:
+                gen_kwargs["adapter_names"] = [items[i][2] for i in indices]
+            started = time.perf_counter()
+            with stage_timer("generate"), torch.inference_mode():
+                summary_ids = model.generate(input_ids=inputs["input_ids"][indices, :width],
+                                             attention_mask=inputs["attention_mask"][indices, :width], **gen_kwargs)
+            generation_latency.observe(profile, time.perf_counter() - started)
+            with stage_timer("decode"):
+                for i, summary in zip(indices, tokenizer.batch_decode(summary_ids, skip_special_tokens=True)):
+                    summaries[i] = summary
+        return summaries
+
+# Bộ gom lô chạy nền: gom các yêu cầu /summarize đồng thời thành một lô generate
+summarize_batcher = MicroBatcher(summarize_batch, max_batch_size=SUMMARIZE_MAX_BATCH_SIZE,
+                                 max_wait_ms=SUMMARIZE_BATCH_WAIT_MS, executor=inference_executor,
+                                 name="summarize", cancellable=True)
+
+def executor_queue_depths() -> dict:
+    """Số tác vụ đang chờ trong hàng đợi của từng pool luồng (đọc lúc scrape /metrics)."""
+    pools = {"inference": inference_executor, "light": light_executor, "translate": local_translator.executor}
+    return {(name, ): pool._work_queue.qsize() for name, pool in pools.items()}
+
+metrics.gauge("chatbot_queue_depth", "Số yêu cầu đang chờ trong hàng đợi gom lô.", ("queue",),
+              callback=lambda: {("summarize", ): summarize_batcher.queue_depth(),
+                                ("translate_local", ): local_translator.batcher.queue_depth()})
+PROFILE_SELECTIONS = metrics.counter("chatbot_generation_profile_total",
+                                     "Số request tóm tắt theo profile yêu cầu và profile thực tế.",
+                                     ("requested", "selected"))
+
+def plan_generation(data: TextIn):
+    """
+    Chọn profile sinh cho request (profile yêu cầu, độ sâu hàng đợi, ngân sách độ trễ)
+    và deadline. Ngân sách là latency_budget_ms hoặc thời gian còn lại đến deadline của
+    request (admission), lấy giá trị nhỏ hơn.
+    Trả về (profile yêu cầu, profile thực tế, deadline hoặc None).
+    Raise ValueError nếu tham số không hợp lệ.
+    """
+    requested = validate_profile(data.profile)
+    budget = data.latency_budget_ms
+    if budget is not None and budget <= 0:
+        raise ValueError("latency_budget_ms phải lớn hơn 0.")
+    request_deadline = current_deadline()
+    if request_deadline is not None:
+        remaining = max(1.0, 1000 * (request_deadline - time.monotonic()))
+        budget = min(budget, remaining) if budget else remaining
+    profile = choose_profile(requested, budget, summarize_batcher.queue_depth(), SUMMARIZE_MAX_BATCH_SIZE,
+                             generation_latency)
+    PROFILE_SELECTIONS.inc(requested=requested, selected=profile)
+    deadline = time.monotonic() + budget / 1000 if budget else None
+    return requested, profile, deadline
+
+metrics.gauge("chatbot_executor_queue_depth", "Số tác vụ đang chờ trong hàng đợi của pool luồng.", ("pool",),
+              callback=executor_queue_depths)
+metrics.gauge("chatbot_model_ready", "1 nếu model tóm tắt đã sẵn sàng.", callback=lambda: int(MODEL_STATUS == "ready"))
+
+_count_tokenizer = (None, None)  # (tokenizer gốc, bản sao dùng để đếm token)
+_count_tokenizer_lock = threading.Lock()
+
+def count_tokens(text: str) -> int:
+    """
+    Đếm token bằng bản sao riêng của tokenizer để chạy được trên light_executor: tokenizer
+    chính bị generate đổi cấu hình truncation/padding trên luồng suy luận nên gọi song song
+    từ luồng khác có thể lỗi "Already borrowed". Bản sao chỉ dùng một cấu hình nên an toàn.
+    """
+    global _count_tokenizer
+    source, counter = _count_tokenizer
+    if source is not tokenizer:
+        with _count_tokenizer_lock:
+            source, counter = _count_tokenizer
+            if source is not tokenizer:
+                source, counter = tokenizer, copy.deepcopy(tokenizer)
+                _count_tokenizer = (source, counter)
+    return len(counter(text, add_special_tokens=False)["input_ids"])
+
+def split_for_summary(text: str) -> list:
+    """Chia văn bản theo ranh giới đoạn/câu thành các khối vừa ngân sách token."""
+    return [chunk for chunk, _ in chunk_text(text, SUMMARIZE_CHUNK_TOKENS, count_tokens)]
+
+async def condense_for_summary(text: str, domain: str, adapter: str, timings: dict,
+                               profile: str = None, deadline: float = None) -> str:
+    """
+    Giai đoạn map của tóm tắt phân cấp: chia văn bản dài thành các khối vừa
+    ngân sách token, tóm tắt song song các khối (đi qua bộ gom lô -> vài lần
+    generate theo lô), ghép các bản tóm tắt và lặp lại cho đến khi vừa một khối.
+    Ghi thời gian (ms) của từng vòng vào timings.
+    """
+    current = text
+    for round_idx in range(SUMMARIZE_MAX_ROUNDS):
+        started = time.perf_counter()
+        # Chỉ dùng tokenizer (bản sao riêng, xem count_tokens): không phải xếp hàng sau generate
+        chunks = await run_in_pool(light_executor, split_for_summary, current)
+        timings[f"split_{round_idx}_ms"] = round(1000 * (time.perf_counter() - started), 1)
+
+        if len(chunks) <= 1:
+            break
 
-    input_text = f"{prefix}: {text}"
-    inputs = tokenizer(input_text, max_length=512, truncation=True, return_tensors="pt").to("cpu")
-    summary_ids = model.generate(inputs["input_ids"], max_length=150, min_length=40, length_penalty=2.0, num_beams=5)
-    summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-    return summary
+        started = time.perf_counter()
+        partials = await asyncio.gather(*[summarize_batcher.submit((chunk, domain, adapter, profile, deadline))
+                                          for chunk in chunks])
+        metrics.STAGE_LATENCY.observe(time.perf_counter() - started, stage="summarize_map")
+        timings[f"map_{round_idx}_ms"] = round(1000 * (time.perf_counter() - started), 1)
+        timings[f"map_{round_idx}_chunks"] = len(chunks)
+        current = "\n".join(partials)
+    return current
 
-def extract_text_from_file_bytes(file_bytes: bytes, filename: str) -> str:
-    filename = filename.lower()
+async def summarize_long_text(text: str, domain: str = "Y tế", adapter: str = None,
+                              profile: str = None, deadline: float = None):
+    """
+    Tóm tắt phân cấp (map-reduce) cho văn bản dài: condense_for_summary rồi
+    tóm tắt lần cuối (reduce). Trả về (summary, timings).
+    """
+    timings = {}
+    current = await condense_for_summary(text, domain, adapter, timings, profile, deadline)
+
+    started = time.perf_counter()
+    summary = await summarize_batcher.submit((current, domain, adapter, profile, deadline))
+    metrics.STAGE_LATENCY.observe(time.perf_counter() - started, stage="summarize_reduce")
+    timings["reduce_ms"] = round(1000 * (time.perf_counter() - started), 1)
+    timings["total_ms"] = round(sum(v for k, v in timings.items() if k.endswith("_ms")), 1)
+    print(f"Tóm tắt phân cấp: {timings}")
+    return summary, timings
+
+def stream_summary(text: str, domain: str, adapter: str, streamer, sampling: bool = False, deadline: float = None,
+                   should_stop=None):
+    """
+    Sinh bản tóm tắt và đẩy từng đoạn token đã giải mã vào streamer.
+    Beam search không hỗ trợ streaming nên dùng greedy (hoặc lấy mẫu top-p).
+    deadline (time.monotonic()): dừng sinh khi hết giờ; should_stop(): dừng khi người nhận đã rời đi.
+    """
     try:
-        if filename.endswith(".pdf"):
-            with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-                pages = pdf.pages
-                text_parts = [p.extract_text() for p in pages if p.extract_text()]
-                return "\n".join(text_parts)
-        elif filename.endswith(".docx"):
-            doc = Document(io.BytesIO(file_bytes))
-            paras = [p.text for p in doc.paragraphs if p.text and p.text.strip() != ""]
-            return "\n".join(paras)
-    except Exception as e:
-        print(f"Lỗi khi đọc file: {e}")
-        return ""
-    return ""
+        input_text = f"{DOMAIN_MAP.get(domain, 'summarize')}: {text}"
+        inputs = tokenizer(input_text, max_length=MAX_INPUT_TOKENS, truncation=True, return_tensors="pt").to("cpu")
+        max_length, min_length = output_lengths(int(inputs["attention_mask"].sum()))
+        gen_kwargs = dict(STREAM_GEN_KWARGS, max_length=max_length, min_length=min_length, streamer=streamer)
+        if deadline is not None:
+            gen_kwargs["max_time"] = max(0.01, deadline - time.monotonic())
+        if should_stop is not None:
+            gen_kwargs["stopping_criteria"] = StoppingCriteriaList([StopWhen(should_stop)])
+        if sampling:
+            gen_kwargs.update(do_sample=True, top_p=0.9, temperature=0.7)
+        else:
+            gen_kwargs.update(do_sample=False, num_beams=1)
+        if MULTI_ADAPTER:
+            gen_kwargs["adapter_names"] = [adapter]
+        with profiler.profile("stream_summary"), stage_timer("generate_stream"), torch.inference_mode():
+            model.generate(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"], **gen_kwargs)
+    except Exception:
+        # Đóng stream để phía async không chờ mãi
+        streamer.end()
+        raise
+
+async def iter_summary_tokens(text: str, domain: str, adapter: str, sampling: bool = False, deadline: float = None):
+    """
+    Chạy stream_summary trên pool suy luận và trả về dần từng đoạn token đã giải mã.
+    Người gọi dừng sớm (client ngắt kết nối) thì model.generate cũng dừng ở token kế tiếp.
+    """
+    streamer = AsyncTextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop = threading.Event()
+    job = asyncio.ensure_future(run_in_pool(inference_executor, stream_summary,
+                                            text, domain, adapter, streamer, sampling, deadline, stop.is_set))
+    try:
+        async for piece in streamer:
+            if piece:
+                yield piece
+        await job
+    finally:
+        stop.set()
+
+# Tiền tố của các thông báo lỗi trả về dạng chuỗi (không nhầm với văn bản bắt đầu bằng chữ "Lỗi")
+ERROR_PREFIXES = ("Lỗi:", "Lỗi dịch:", "Lỗi không xác định", "Lỗi API", "Lỗi khi tìm kiếm:")
+
+def is_error_message(text: str) -> bool:
+    """Các hàm xử lý trả lỗi dưới dạng chuỗi "Lỗi: ..."."""
+    return isinstance(text, str) and text.lstrip().startswith(ERROR_PREFIXES)
+
+def is_error_text(text: str) -> bool:
+    """Thông báo lỗi hoặc kết quả rỗng: không được lưu vào cache."""
+    return not text or is_error_message(text)
+
+def summary_cache_key(text: str, domain: str, adapter: str, hierarchical: bool, gen_kwargs: dict) -> str:
+    return make_key("summarize", text, domain=domain, adapter=adapter, hierarchical=hierarchical, model=MODEL_ID,
+                    max_input_tokens=MAX_INPUT_TOKENS, chunk_tokens=SUMMARIZE_CHUNK_TOKENS,
+                    generation=gen_kwargs)
+
+def sse_event(payload: dict, event: str = None) -> str:
+    """Định dạng một sự kiện Server-Sent Events (dữ liệu là JSON một dòng)."""
+    data = json.dumps(payload, ensure_ascii=False)
+    return f"event: {event}\ndata: {data}\n\n" if event else f"data: {data}\n\n"
+
+def translate_cache_key(text: str) -> str:
+    return make_key("translate", text, target_language='Vietnamese', **translation.cache_params())
+
+async def translate_item(data: TextIn) -> dict:
+    """Dịch một văn bản sang tiếng Việt (có cache). Dùng chung cho /translate và /translate_batch."""
+    key = translate_cache_key(data.text)
+    cached = await result_cache.aget(key)
+    if cached is not None:
+        return {"result": cached, "cached": True}
+    language = await detect_language_item(data)
+    result = await translate_text(data.text, target_language='Vietnamese', source_language=language["language"])
+    if not is_error_text(result):
+        await result_cache.aset(key, result)
+    return {"result": result}
+
+async def summarize_item(data: TextIn) -> dict:
+    """
+    Tóm tắt một văn bản (có cache, gom lô, tóm tắt phân cấp). Dùng chung cho /summarize
+    và /summarize_batch. Raise ValueError nếu adapter không hợp lệ.
+    """
+    adapter = resolve_adapter(data.domain, data.adapter)
+    requested, profile, deadline = plan_generation(data)
+    # Kết quả của profile yêu cầu (nếu đã có) tốt hơn kết quả của profile đã hạ bậc
+    for candidate in dict.fromkeys((requested, profile)):
+        key = summary_cache_key(data.text, data.domain, adapter, data.hierarchical, cache_params(candidate))
+        cached = await result_cache.aget(key)
+        if cached is not None:
+            return {"result": cached, "cached": True, "profile": candidate}
+
+    timings = None
+    if data.hierarchical:
+        summary, timings = await summarize_long_text(data.text, data.domain, adapter, profile, deadline)
+    else:
+        summary = await summarize_batcher.submit((data.text, data.domain, adapter, profile, deadline))
+    # Bản tóm tắt bị cắt ngang vì hết ngân sách thời gian thì không cache
+    if not is_error_text(summary) and (deadline is None or time.monotonic() < deadline):
+        key = summary_cache_key(data.text, data.domain, adapter, data.hierarchical, cache_params(profile))
+        await result_cache.aset(key, summary)
+    return {"result": summary, "timings": timings, "profile": profile}
+
+async def detect_language_item(data: TextIn) -> dict:
+    """Trả về {"is_vietnamese", "language", "confidence", "method"}."""
+    with stage_timer("detect_language"):
+        return await run_in_pool(light_executor, identify_language, data.text)
+
+def elapsed_ms(started: float) -> float:
+    return round(1000 * (time.perf_counter() - started), 1)
+
+async def process_events(data: ProcessIn, adapter: str, plan: tuple):
+    """
+    Pipeline gộp phía server: nhận diện ngôn ngữ -> dịch (nếu cần) -> tóm tắt.
+    Trả về dần các cặp (event, payload): "language", "translation_chunk" (mỗi khối vừa
+    dịch xong, theo thứ tự), "translation", "token" (chỉ khi data.stream) và cuối cùng "done".
+
+    Giai đoạn map của tóm tắt phân cấp gối đầu với việc dịch: mỗi khối vừa dịch xong
+    được chia theo ngân sách token và đưa ngay vào bộ gom lô trong khi các khối sau
+    vẫn đang được dịch. plan: kết quả plan_generation(data).
+    Raise nếu dịch lỗi (APIError) hoặc không có chức năng dịch.
+    """
+    _, profile, deadline = plan
+    started = time.perf_counter()
+    timings = {}
+
+    stage = time.perf_counter()
+    language = await detect_language_item(data)
+    is_vi = language["is_vietnamese"]
+    timings["detect_ms"] = elapsed_ms(stage)
+    yield "language", language
+
+    text = data.text
+    translation = None
+    condensed = None  # Kết quả map đã chạy gối đầu với dịch (nếu có)
+    if not is_vi:
+        if not translation_available():
+            raise RuntimeError("Chức năng dịch không khả dụng.")
+        stage = time.perf_counter()
+        translate_key = translate_cache_key(data.text)
+        translation = await result_cache.aget(translate_key)
+        if translation is not None:
+            timings["translate_cached"] = True
+        else:
+            parts, chunks, partials = [], [], []
+            try:
+                async for translated, sep in iter_translated_chunks(data.text, target_language='Vietnamese',
+                                                                   source_language=language["language"]):
+                    if not parts:
+                        timings["first_translation_ms"] = elapsed_ms(stage)
+                    yield "translation_chunk", {"index": len(parts), "text": translated}
+                    parts.append(translated + sep)
+                    if not data.hierarchical:
+                        continue
+                    chunks.extend(await run_in_pool(light_executor, split_for_summary, translated))
+                    # Chỉ bắt đầu map khi đã chắc có >= 2 khối: văn bản ngắn đi thẳng tới bước tóm tắt cuối
+                    if len(chunks) >= 2:
+                        partials.extend(asyncio.ensure_future(
+                            summarize_batcher.submit((chunk, data.domain, adapter, profile, deadline)))
+                            for chunk in chunks[len(partials):])
+                translation = "".join(parts).strip()
+                timings["translate_ms"] = elapsed_ms(stage)
+                await result_cache.aset(translate_key, translation)
+
+                if partials:
+                    stage = time.perf_counter()
+                    summaries = await asyncio.gather(*partials)
+                    # Phần map còn phải chờ sau khi dịch xong (phần còn lại đã chạy song song với dịch)
+                    timings["map_tail_ms"] = elapsed_ms(stage)
+                    timings["map_chunks"] = len(partials)
+                    condensed = "\n".join(summaries)
+            finally:
+                for task in partials:
+                    task.cancel()
+        yield "translation", {"result": translation, "cached": bool(timings.get("translate_cached"))}
+        text = translation
+
+    # Tóm tắt: khoá cache giống /summarize (chế độ stream dùng tham số sinh greedy như /summarize_stream)
+    gen_params = stream_cache_params(profile, data.hierarchical) if data.stream else cache_params(profile)
+    key = summary_cache_key(text, data.domain, adapter, data.hierarchical, gen_params)
+    summary = await result_cache.aget(key)
+    cached = summary is not None
+    if cached:
+        if data.stream:
+            yield "token", {"token": summary}
+    else:
+        current = text if condensed is None else condensed
+        if data.hierarchical:
+            current = await condense_for_summary(current, data.domain, adapter, timings, profile, deadline)
+
+        stage = time.perf_counter()
+        if data.stream:
+            pieces = []
+            async for piece in iter_summary_tokens(current, data.domain, adapter, deadline=deadline):
+                if not pieces:
+                    timings["first_token_ms"] = elapsed_ms(started)
+                pieces.append(piece)
+                yield "token", {"token": piece}
+            summary = "".join(pieces)
+        else:
+            summary = await summarize_batcher.submit((current, data.domain, adapter, profile, deadline))
+        timings["summarize_ms"] = elapsed_ms(stage)
+        if not is_error_text(summary) and (deadline is None or time.monotonic() < deadline):
+            await result_cache.aset(key, summary)
+
+    timings["total_ms"] = elapsed_ms(started)
+    print(f"Pipeline /process: {timings}")
+    yield "done", {"result": summary, "is_vietnamese": is_vi, "translation": translation,
+                   "timings": timings, "cached": cached, "profile": "greedy" if data.stream else profile}
+
+async def read_batch_items(request: Request) -> list:
+    """
+    Đọc đầu vào của endpoint batch: JSON (danh sách TextIn hoặc {"items": [...]})
+    hoặc JSONL (Content-Type: application/x-ndjson / application/jsonl).
+    Body được đọc hết trước khi bắt đầu trả response (StreamingResponse dùng chung kênh
+    nhận của ASGI để theo dõi client ngắt kết nối). Dòng JSONL lỗi trở thành exception
+    của riêng phần tử đó. Raise ValueError nếu body JSON không hợp lệ.
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(e)
+        return items
+
+    payload = json.loads(body)
+    items = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        raise ValueError('Đầu vào phải là danh sách hoặc {"items": [...]}.')
+    return items
+
+async def run_batch(request: Request, handler):
+    """
+    Xử lý đồng thời các phần tử (tối đa BATCH_ENDPOINT_CONCURRENCY) và trả về JSONL
+    theo thứ tự hoàn thành: {"index": i, ...kết quả} hoặc {"index": i, "error": "..."}.
+    Lỗi (kể cả quá deadline) của một phần tử không làm hỏng cả batch.
+    """
+    try:
+        items = await read_batch_items(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"result": "", "error": f"Đầu vào không hợp lệ: {e}"})
+
+    queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(BATCH_ENDPOINT_CONCURRENCY)
+    tasks = set()
+
+    async def run_one(index, raw):
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            # Mỗi phần tử có deadline riêng (timeout của nhóm endpoint), không dùng chung deadline của batch
+            output = await admission.run_item(request.url.path, handler(TextIn.model_validate(raw)))
+            # Kết quả rỗng là kết quả hợp lệ (chỉ không được cache), không phải lỗi
+            if is_error_message(output.get("result")):
+                output = {"error": output["result"]}
+        except asyncio.TimeoutError:
+            output = {"error": "Hết thời gian xử lý phần tử."}
+        except Exception as e:
+            output = {"error": str(e)}
+        finally:
+            semaphore.release()
+        await queue.put({"index": index, **output})
+
+    async def feed():
+        # Chỉ tạo task khi còn chỗ (semaphore) để không sinh hàng nghìn task cùng lúc
+        for index, raw in enumerate(items):
+            await semaphore.acquire()
+            task = asyncio.ensure_future(run_one(index, raw))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def jsonl_stream():
+        feeder = asyncio.ensure_future(feed())
+        try:
+            for _ in range(len(items)):
+                message = await queue.get()
+                yield json.dumps(message, ensure_ascii=False) + "\n"
+        finally:
+            # Client ngắt kết nối: huỷ phần việc còn lại
+            feeder.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+    return StreamingResponse(jsonl_stream(), media_type="application/x-ndjson")
 
 # Định nghĩa API Endpoints 
+@app.get("/health")
+async def health_endpoint():
+    """Sẵn sàng ngay khi server khởi động; cho biết trạng thái tải model."""
+    return {"status": "ok", "pid": os.getpid(), "model": MODEL_STATUS, "model_id": MODEL_ID,
+            "startup_timings": STARTUP_TIMINGS,
+            "translation": translation.status()}
+
 @app.post("/agent_search", response_model=ApiResponse)
 async def agent_search_endpoint(data: QueryIn):
     if not AGENT_AVAILABLE:
         return JSONResponse(status_code=500, content={"result": "", "error": "Agent không khả dụng trên server."})
     try:
-        result = rag_agent(data.query)
+        result = await rag_agent(data.query)
         return {"result": result}
     except Exception as e:
         return JSONResponse(status_code=500, content={"result": "", "error": str(e)})
 
+class SpooledStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse xoá file tạm (đã spool) khi kết thúc, kể cả khi client ngắt kết nối
+    hoặc request bị huỷ trước khi generator bắt đầu chạy (lúc đó cả finally của generator
+    lẫn BackgroundTask đều không được gọi).
+    """
+
+    def __init__(self, content, path: str, **kwargs):
+        super().__init__(content, **kwargs)
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            os.unlink(self.path)
+
+EXTRACT_ERROR_MESSAGE = "Không thể trích xuất nội dung từ file."
+
+async def spool_upload(file: UploadFile) -> str:
+    """Ghi file upload ra đĩa (theo khối) để các tiến trình con đọc theo đường dẫn."""
+    suffix = os.path.splitext(file.filename or "")[1]
+    return await run_in_pool(light_executor, spool_to_disk, file.file, suffix)
+
 @app.post("/extract_text", response_model=ApiResponse)
-async def extract_text_endpoint(file: UploadFile = File(...)):
+async def extract_text_endpoint(file: UploadFile = File(...), first_page: int = 1, last_page: Optional[int] = None):
+    path = None
     try:
-        file_bytes = await file.read()
-        text = extract_text_from_file_bytes(file_bytes, file.filename)
+        path = await spool_upload(file)
+        parts = []
+        async for record in iter_extracted_text(path, file.filename, parse_executor, first_page, last_page,
+                                                max_inflight=PARSE_WORKERS * 2):
+            if record["text"]:
+                parts.append(record["text"])
+        text = "\n".join(parts)
         if not text:
-            return JSONResponse(status_code=400, content={"result": "", "error": "Không thể trích xuất nội dung từ file."})
+            return JSONResponse(status_code=400, content={"result": "", "error": EXTRACT_ERROR_MESSAGE})
         return {"result": text}
+    except PARSE_ERRORS as e:
+        print(f"Lỗi khi đọc file {file.filename}: {e}")
+        return JSONResponse(status_code=400, content={"result": "", "error": EXTRACT_ERROR_MESSAGE})
     except Exception as e:
         return JSONResponse(status_code=500, content={"result": "", "error": str(e)})
+    finally:
+        if path:
+            os.unlink(path)
+
+@app.post("/extract_text_stream")
+async def extract_text_stream_endpoint(file: UploadFile = File(...), first_page: int = 1, last_page: Optional[int] = None):
+    """
+    Trích xuất văn bản và trả về dần dưới dạng NDJSON (mỗi dòng một dải trang / nhóm đoạn),
+    theo đúng thứ tự trang. Dòng cuối: {"done": true} hoặc {"error": "..."}.
+    """
+    path = await spool_upload(file)
+
+    async def ndjson_stream():
+        try:
+            async for record in iter_extracted_text(path, file.filename, parse_executor, first_page, last_page,
+                                                    max_inflight=PARSE_WORKERS * 2):
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True}) + "\n"
+        except PARSE_ERRORS as e:
+            print(f"Lỗi khi đọc file {file.filename}: {e}")
+            yield json.dumps({"error": EXTRACT_ERROR_MESSAGE}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
+    return SpooledStreamingResponse(ndjson_stream(), path, media_type="application/x-ndjson")
 
 @app.post("/detect_language", response_model=BoolResponse)
 async def detect_language_endpoint(data: TextIn):
-    result = is_vietnamese(data.text)
-    return {"is_vietnamese": result}
+    return await detect_language_item(data)
 
 @app.post("/translate", response_model=ApiResponse)
 async def translate_endpoint(data: TextIn):
-    if not AGENT_AVAILABLE:
+    if not translation_available():
         return JSONResponse(status_code=500, content={"result": "", "error": "Chức năng dịch không khả dụng."})
     try:
-        result = translate_text(data.text, target_language='Vietnamese')
-        return {"result": result}
+        return await translate_item(data)
     except Exception as e:
         return JSONResponse(status_code=500, content={"result": "", "error": str(e)})
 
 @app.post("/summarize", response_model=ApiResponse)
 async def summarize_endpoint(data: TextIn):
-    if not model:
+    if not await wait_for_model():
+        return JSONResponse(status_code=500, content={"result": "", "error": "Model tóm tắt không khả dụng."})
+    try:
+        return await summarize_item(data)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"result": "", "error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"result": "", "error": str(e)})
+
+@app.post("/detect_language_batch")
+async def detect_language_batch_endpoint(request: Request):
+    """Nhận diện ngôn ngữ cho nhiều văn bản; đầu vào JSON/JSONL, đầu ra JSONL theo thứ tự hoàn thành."""
+    return await run_batch(request, detect_language_item)
+
+@app.post("/translate_batch")
+async def translate_batch_endpoint(request: Request):
+    """Dịch nhiều văn bản đồng thời; đầu vào JSON/JSONL, đầu ra JSONL theo thứ tự hoàn thành."""
+    if not translation_available():
+        return JSONResponse(status_code=500, content={"result": "", "error": "Chức năng dịch không khả dụng."})
+    return await run_batch(request, translate_item)
+
+@app.post("/summarize_batch")
+async def summarize_batch_endpoint(request: Request):
+    """
+    Tóm tắt nhiều văn bản; các phần tử đi qua bộ gom lô nên được sinh theo lô.
+    Đầu vào JSON/JSONL, đầu ra JSONL theo thứ tự hoàn thành.
+    """
+    if not await wait_for_model():
+        return JSONResponse(status_code=500, content={"result": "", "error": "Model tóm tắt không khả dụng."})
+    return await run_batch(request, summarize_item)
+
+@app.post("/summarize_stream")
+async def summarize_stream_endpoint(data: StreamIn):
+    """
+    Phiên bản streaming của /summarize (Server-Sent Events):
+    - data: {"token": "..."} cho mỗi đoạn token vừa sinh
+    - event: done, data: {"result": "...", "timings": {...}} khi hoàn tất
+    - event: error, data: {"error": "..."} nếu có lỗi
+    """
+    if not await wait_for_model():
         return JSONResponse(status_code=500, content={"result": "", "error": "Model tóm tắt không khả dụng."})
+
     try:
-        summary = summarize_text(data.text, data.domain)
-        return {"result": summary}
+        adapter = resolve_adapter(data.domain, data.adapter)
+        _, profile, deadline = plan_generation(data)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"result": "", "error": str(e)})
+
+    # Lấy mẫu không tất định nên chỉ cache chế độ greedy
+    key = None if data.sampling else summary_cache_key(data.text, data.domain, adapter, data.hierarchical,
+                                                       stream_cache_params(profile, data.hierarchical))
+
+    async def event_stream():
+        timings = {}
+        started = time.perf_counter()
+        try:
+            cached = await result_cache.aget(key) if key else None
+            if cached is not None:
+                yield sse_event({"token": cached})
+                yield sse_event({"result": cached, "timings": timings, "cached": True}, event="done")
+                return
+
+            text = data.text
+            if data.hierarchical:
+                text = await condense_for_summary(text, data.domain, adapter, timings, profile, deadline)
+
+            parts = []
+            async for piece in iter_summary_tokens(text, data.domain, adapter, data.sampling, deadline):
+                if not parts:
+                    timings["first_token_ms"] = round(1000 * (time.perf_counter() - started), 1)
+                parts.append(piece)
+                yield sse_event({"token": piece})
+
+            timings["total_ms"] = round(1000 * (time.perf_counter() - started), 1)
+            summary = "".join(parts)
+            if key and not is_error_text(summary) and (deadline is None or time.monotonic() < deadline):
+                await result_cache.aset(key, summary)
+            yield sse_event({"result": summary, "timings": timings}, event="done")
+        except Exception as e:
+            yield sse_event({"error": str(e)}, event="error")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/process", response_model=ProcessResponse)
+async def process_endpoint(data: ProcessIn):
+    """
+    Nhận diện ngôn ngữ -> dịch -> tóm tắt trong một request (thay cho 3 lượt gọi từ client).
+    Trả về {"result", "is_vietnamese", "translation", "timings"} với thời gian từng giai đoạn.
+    Nếu stream=true: Server-Sent Events
+    - event: language, data: {"is_vietnamese": ..., "language": ..., "confidence": ...}
+    - event: translation_chunk, data: {"index": i, "text": "..."} cho mỗi khối vừa dịch xong
+    - event: translation, data: {"result": "..."}
+    - data: {"token": "..."} cho mỗi đoạn token tóm tắt vừa sinh
+    - event: done, data: như response JSON; event: error, data: {"error": "..."} nếu có lỗi
+    """
+    if not await wait_for_model():
+        return JSONResponse(status_code=500, content={"result": "", "error": "Model tóm tắt không khả dụng."})
+
+    try:
+        adapter = resolve_adapter(data.domain, data.adapter)
+        plan = plan_generation(data)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"result": "", "error": str(e)})
+
+    if data.stream:
+        async def event_stream():
+            try:
+                async for event, payload in process_events(data, adapter, plan):
+                    yield sse_event(payload, event=None if event == "token" else event)
+            except Exception as e:
+                yield sse_event({"error": str(e)}, event="error")
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    try:
+        async for event, payload in process_events(data, adapter, plan):
+            if event == "done":
+                return payload
     except Exception as e:
         return JSONResponse(status_code=500, content={"result": "", "error": str(e)})
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Metric định dạng Prometheus: histogram theo giai đoạn, lỗi/retry upstream, hàng đợi, request đang xử lý."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def admin_denied(request: Request):
+    if not is_admin(request.headers.get("x-admin-token")):
+        return JSONResponse(status_code=403, content={"error": "Không có quyền truy cập."})
+    return None
+
+# Profiling lộ mã nguồn/thời gian chạy và tốn CPU: chỉ mở khi đặt PROFILING_ADMIN_TOKEN
+if PROFILING_ADMIN_TOKEN:
+    @app.get("/debug/profile")
+    async def get_profile_endpoint(request: Request):
+        """Cấu hình profiling hiện tại và các kết quả profile gần nhất."""
+        denied = admin_denied(request)
+        if denied:
+            return denied
+        return {**profiler.status(), "results": profiler.profiles()}
+
+    @app.post("/debug/profile")
+    async def set_profile_endpoint(data: ProfileConfigIn, request: Request):
+        """
+        Bật/tắt profiling lúc chạy, ví dụ {"mode": "cprofile", "sample_rate": 0.1}.
+        cprofile: lấy mẫu cả request (luồng event loop) lẫn các lần generate; torch: chỉ các lần generate.
+        """
+        denied = admin_denied(request)
+        if denied:
+            return denied
+        try:
+            return profiler.configure(data.mode, data.sample_rate, data.max_profiles)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+@app.get("/batch_stats")
+async def batch_stats_endpoint():
+    return {**summarize_batcher.stats(), "generate_ms_by_profile": generation_latency.stats(),
+            "translate_local": local_translator.batcher.stats()}
+
+@app.get("/adapters")
+async def adapters_endpoint():
+    """Danh sách LoRA adapter đang phục vụ và bảng định tuyến domain -> adapter."""
+    return {
+        "multi_adapter": MULTI_ADAPTER,
+        "adapters": ADAPTERS,
+        "default": ADAPTERS[0] if ADAPTERS else None,
+        "domains": ADAPTER_DOMAINS,
+    }
+
+@app.get("/admission_stats")
+async def admission_stats_endpoint():
+    return admission.stats()
+
+@app.get("/cache_stats")
+async def cache_stats_endpoint():
+    stats = await result_cache.astats()
+    if AGENT_AVAILABLE:
+        stats["agent"] = agent_cache_stats()
+    return stats
+
 if __name__ == "__main__":
     
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
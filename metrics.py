@@ -0,0 +1,255 @@
+# metrics.py
+"""
+Đo lường nội bộ theo định dạng Prometheus (text exposition 0.0.4), không cần thư viện ngoài.
+Các metric an toàn khi ghi từ nhiều luồng (event loop, pool suy luận, pool nhẹ).
+
+- Histogram thời gian theo giai đoạn: tokenize, generate, decode, trích xuất PDF, Serper, Gemini, backoff...
+- Counter: request HTTP theo mã trạng thái, lỗi upstream theo mã lỗi, số lần thử lại.
+- Gauge: request đang xử lý, độ sâu hàng đợi (đọc lúc scrape qua callback).
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self):
+        """Trả về danh sách (hậu tố tên, giá trị nhãn, nhãn thêm, giá trị)."""
+        with self._lock:
+            return [("", key, "", value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Gauge đặt giá trị trực tiếp (set/inc/dec) hoặc đọc lúc scrape qua callback.
+    callback trả về một số, hoặc dict {tuple giá trị nhãn: số}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self.callback is None:
+            return super()._samples()
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"Lỗi khi đọc metric {self.name}: {e}")
+            return []
+        if isinstance(value, dict):
+            return [("", key if isinstance(key, tuple) else (key,), "", v) for key, v in value.items()]
+        return [("", (), "", value)]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Đo thời gian (giây) của khối lệnh bên trong, kể cả khi có exception."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append(("_bucket", key, f'le="{_format_value(bound)}"', cumulative))
+                samples.append(("_sum", key, "", total))
+                samples.append(("_count", key, "", count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric đã tồn tại: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames=(), callback=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, callback))
+
+
+def histogram(name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+#  Các metric dùng chung giữa các module
+HTTP_REQUESTS = counter("chatbot_http_requests_total", "Số request HTTP đã xử lý.",
+                        ("method", "endpoint", "status"))
+HTTP_LATENCY = histogram("chatbot_http_request_duration_seconds",
+                         "Thời gian xử lý request HTTP (đến byte cuối cùng của response).", ("method", "endpoint"))
+HTTP_IN_FLIGHT = gauge("chatbot_http_requests_in_flight", "Số request HTTP đang xử lý.")
+
+STAGE_LATENCY = histogram("chatbot_stage_duration_seconds",
+                          "Thời gian của từng giai đoạn xử lý (tokenize, generate, decode, extract_pdf, ...).",
+                          ("stage",))
+BATCH_SIZE = histogram("chatbot_batch_size", "Kích thước các lô đã xử lý của bộ gom lô.", ("batcher",),
+                       buckets=(1, 2, 4, 8, 16, 32, 64))
+
+UPSTREAM_LATENCY = histogram("chatbot_upstream_request_duration_seconds",
+                             "Thời gian mỗi lời gọi dịch vụ ngoài (Serper, Gemini).", ("upstream", "operation"))
+UPSTREAM_ERRORS = counter("chatbot_upstream_errors_total", "Số lỗi từ dịch vụ ngoài theo mã lỗi.",
+                          ("upstream", "operation", "code"))
+UPSTREAM_RETRIES = counter("chatbot_upstream_retries_total", "Số lần thử lại lời gọi dịch vụ ngoài.",
+                           ("upstream", "operation"))
+
+
+def route_template(scope) -> str:
+    """
+    Đường dẫn mẫu của route ứng với request. Request bị middleware (admission) từ chối trước
+    khi tới router thì chưa có scope["route"], nên tự so khớp với các route của ứng dụng.
+    """
+    route = scope.get("route")
+    if route is None:
+        for candidate in getattr(getattr(scope.get("app"), "router", None), "routes", ()):
+            match, _ = candidate.matches(scope)
+            if match.name != "NONE":
+                route = candidate
+                break
+    return getattr(route, "path", None) or "unmatched"
+
+
+def stage_timer(stage: str):
+    """Context manager đo thời gian một giai đoạn vào chatbot_stage_duration_seconds."""
+    return STAGE_LATENCY.time(stage=stage)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware đếm request, đo thời gian đến byte cuối của response (đúng cả với
+    StreamingResponse) và theo dõi số request đang xử lý. Nhãn endpoint là đường dẫn
+    mẫu của route (ví dụ /summarize) để số chuỗi metric không tăng theo URL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            endpoint = route_template(scope)
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=scope["method"], endpoint=endpoint)
+            HTTP_REQUESTS.inc(method=scope["method"], endpoint=endpoint, status=status["code"])
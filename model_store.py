@@ -0,0 +1,210 @@
+# model_store.py
+"""
+Bộ đệm artifact mô hình đã merge LoRA.
+
+Lần đầu: tải mô hình nền + LoRA adapter, merge_and_unload() rồi lưu trọng số đã merge
+(safetensors) kèm tokenizer vào một thư mục có phiên bản, khoá theo tên mô hình nền
++ mã băm của adapter. Các lần khởi động sau nạp thẳng artifact này (safetensors được
+memory-map) thay vì tải + merge lại.
+
+Chạy trước một lần (ví dụ khi build Docker image):
+    python model_store.py
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+from transformers import AutoTokenizer, T5ForConditionalGeneration
+
+try:
+    from peft import PeftModel
+    PEFT_AVAILABLE = True
+except ImportError:
+    PEFT_AVAILABLE = False
+
+BASE_MODEL_NAME = os.getenv("BASE_MODEL_NAME", "VietAI/vit5-base")
+LORA_ADAPTER_PATH = os.getenv(
+    "LORA_ADAPTER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "lora-lbc-fast_10k")
+)
+# Nhiều adapter dùng chung MỘT mô hình nền (không merge): "ten=duong_dan,ten2=duong_dan2"
+LORA_ADAPTERS = os.getenv("LORA_ADAPTERS", "")
+MERGED_ARTIFACT_DIR = os.getenv("MERGED_ARTIFACT_DIR", os.path.join("artifacts", "merged"))
+ARTIFACT_VERSION = 1
+
+_ADAPTER_FILES = ("adapter_config.json", "adapter_model.safetensors", "adapter_model.bin")
+
+
+def parse_mapping(spec: str) -> dict:
+    """Đọc chuỗi cấu hình dạng "khoa=gia_tri,khoa2=gia_tri2" thành dict (giữ thứ tự)."""
+    mapping = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            if key.strip() and value.strip():
+                mapping[key.strip()] = value.strip()
+    return mapping
+
+
+def adapter_fingerprint(adapter_path: str) -> str:
+    """Mã băm sha256 của cấu hình + trọng số adapter."""
+    h = hashlib.sha256()
+    for name in _ADAPTER_FILES:
+        path = os.path.join(adapter_path, name)
+        if not os.path.exists(path):
+            continue
+        h.update(name.encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+
+def artifact_dir(base_model: str, adapter_path: str, fingerprint: str = None) -> str:
+    fingerprint = fingerprint or adapter_fingerprint(adapter_path)
+    name = f"{base_model}__{os.path.basename(os.path.normpath(adapter_path))}"
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+    return os.path.join(MERGED_ARTIFACT_DIR, f"{name}-v{ARTIFACT_VERSION}-{fingerprint[:12]}")
+
+
+def _timed(timings: dict, key: str, started: float):
+    timings[key] = round(time.perf_counter() - started, 3)
+
+
+def load_artifact(path: str, timings: dict):
+    """Nạp mô hình đã merge từ artifact (safetensors, memory-map)."""
+    started = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    _timed(timings, "tokenizer_s", started)
+
+    started = time.perf_counter()
+    model = T5ForConditionalGeneration.from_pretrained(path, low_cpu_mem_usage=True).eval()
+    _timed(timings, "artifact_load_s", started)
+    return model, tokenizer
+
+
+def build_artifact(base_model: str, adapter_path: str, path: str, timings: dict, save: bool = True):
+    """Tải mô hình nền + adapter, merge và (tuỳ chọn) lưu artifact một cách nguyên tử."""
+    started = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    _timed(timings, "tokenizer_s", started)
+
+    started = time.perf_counter()
+    base = T5ForConditionalGeneration.from_pretrained(base_model)
+    _timed(timings, "base_load_s", started)
+
+    started = time.perf_counter()
+    model = PeftModel.from_pretrained(base, adapter_path).merge_and_unload().eval()
+    _timed(timings, "adapter_merge_s", started)
+
+    if save:
+        started = time.perf_counter()
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        try:
+            model.save_pretrained(tmp_path, safe_serialization=True)
+            tokenizer.save_pretrained(tmp_path)
+            with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "base_model": base_model,
+                    "adapter": os.path.basename(os.path.normpath(adapter_path)),
+                    "adapter_sha256": adapter_fingerprint(adapter_path),
+                    "version": ARTIFACT_VERSION,
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                }, f, indent=2)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.replace(tmp_path, path)
+            print(f"Đã lưu artifact mô hình đã merge: {path}")
+        except Exception as e:
+            print(f"Không lưu được artifact mô hình ({path}): {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        _timed(timings, "artifact_save_s", started)
+    return model, tokenizer
+
+
+def load_merged_model(base_model: str = BASE_MODEL_NAME, adapter_path: str = LORA_ADAPTER_PATH,
+                      timings: dict = None, save: bool = True):
+    """
+    Trả về (model, tokenizer, model_id) của mô hình đã merge LoRA, ưu tiên artifact có sẵn.
+    Trả về None nếu thiếu peft hoặc không tìm thấy adapter.
+    """
+    timings = {} if timings is None else timings
+    if not PEFT_AVAILABLE:
+        print("Bỏ qua load model cục bộ vì thiếu thư viện peft.")
+        return None
+    if not os.path.exists(adapter_path):
+        print(f"Không tìm thấy LoRA adapter tại {adapter_path}.")
+        return None
+
+    started = time.perf_counter()
+    fingerprint = adapter_fingerprint(adapter_path)
+    _timed(timings, "adapter_hash_s", started)
+    path = artifact_dir(base_model, adapter_path, fingerprint)
+    model_id = f"{base_model}+{os.path.basename(os.path.normpath(adapter_path))}@{fingerprint[:12]}"
+
+    if os.path.exists(os.path.join(path, "manifest.json")):
+        print(f"Đang nạp artifact mô hình đã merge: {path}")
+        try:
+            model, tokenizer = load_artifact(path, timings)
+            return model, tokenizer, model_id
+        except Exception as e:
+            print(f"Artifact hỏng ({e}). Đang merge lại...")
+
+    print(f"Đang tải mô hình nền tảng ({base_model}) và LoRA adapter...")
+    model, tokenizer = build_artifact(base_model, adapter_path, path, timings, save=save)
+    return model, tokenizer, model_id
+
+
+def load_multi_adapter_model(base_model: str, adapters: dict, timings: dict = None):
+    """
+    Giữ MỘT mô hình nền trong RAM và đăng ký nhiều LoRA adapter (không merge),
+    mỗi request chọn adapter qua tham số adapter_names của generate.
+    Trả về (model, tokenizer, model_id) hoặc None nếu không nạp được adapter nào.
+    """
+    timings = {} if timings is None else timings
+    if not PEFT_AVAILABLE:
+        print("Bỏ qua load nhiều adapter vì thiếu thư viện peft.")
+        return None
+    available = {}
+    for name, path in adapters.items():
+        if os.path.exists(path):
+            available[name] = path
+        else:
+            print(f"Không tìm thấy LoRA adapter '{name}' tại {path}. Bỏ qua.")
+    if not available:
+        return None
+
+    started = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    _timed(timings, "tokenizer_s", started)
+
+    started = time.perf_counter()
+    base = T5ForConditionalGeneration.from_pretrained(base_model, low_cpu_mem_usage=True)
+    _timed(timings, "base_load_s", started)
+
+    started = time.perf_counter()
+    model = None
+    for name, path in available.items():
+        if model is None:
+            model = PeftModel.from_pretrained(base, path, adapter_name=name)
+        else:
+            model.load_adapter(path, adapter_name=name)
+    model.eval()
+    _timed(timings, "adapters_load_s", started)
+
+    ids = "+".join(f"{name}@{adapter_fingerprint(path)[:12]}" for name, path in available.items())
+    print(f"Đã nạp {len(available)} LoRA adapter trên một mô hình nền: {list(available)}")
+    return model, tokenizer, f"{base_model}+{ids}"
+
+
+if __name__ == "__main__":
+    timings = {}
+    started = time.perf_counter()
+    result = load_merged_model(timings=timings)
+    if result is None:
+        raise SystemExit("Không tạo được artifact mô hình.")
+    timings["total_s"] = round(time.perf_counter() - started, 3)
+    print(f"Artifact sẵn sàng: {artifact_dir(BASE_MODEL_NAME, LORA_ADAPTER_PATH)}")
+    print(f"Thời gian: {timings}")
@@ -0,0 +1,132 @@
+# profiling.py
+"""
+Hook profiling bật/tắt được lúc chạy (POST /debug/profile), lấy mẫu một phần lời gọi:
+- "cprofile": cProfile trên luồng đang chạy đoạn mã (pool suy luận hoặc event loop)
+- "torch": torch.profiler (các toán tử CPU của model.generate)
+Kết quả (bảng top hàm/toán tử) được giữ trong bộ nhớ, xem qua GET /debug/profile.
+Các route /debug/profile chỉ được đăng ký khi đặt PROFILING_ADMIN_TOKEN và yêu cầu header
+X-Admin-Token khớp với token này; PROFILE_MODE vẫn bật được profiling lúc khởi động.
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PROFILE_MODES = ("off", "cprofile", "torch")
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+
+
+def is_admin(token: str) -> bool:
+    """Token trong header X-Admin-Token có khớp PROFILING_ADMIN_TOKEN không (so sánh thời gian hằng)."""
+    return bool(PROFILING_ADMIN_TOKEN) and hmac.compare_digest((token or "").encode(), PROFILING_ADMIN_TOKEN.encode())
+
+
+class Profiler:
+    def __init__(self, mode: str = "off", sample_rate: float = 1.0, max_profiles: int = 20, top: int = 30):
+        self.top = top
+        self._lock = threading.Lock()
+        self._active = threading.local()
+        self._profiles = deque(maxlen=max(1, max_profiles))
+        self.mode = "off"
+        self.sample_rate = 1.0
+        self.configure(mode, sample_rate)
+
+    def configure(self, mode: str, sample_rate: float = None, max_profiles: int = None) -> dict:
+        """Đổi chế độ profiling lúc chạy. Raise ValueError nếu tham số không hợp lệ."""
+        mode = (mode or "off").lower()
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Chế độ profiling không hợp lệ: {mode}. Hỗ trợ: {list(PROFILE_MODES)}")
+        if sample_rate is not None and not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate phải nằm trong [0, 1].")
+        with self._lock:
+            self.mode = mode
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if max_profiles is not None:
+                self._profiles = deque(self._profiles, maxlen=max(1, max_profiles))
+        return self.status()
+
+    def status(self) -> dict:
+        return {"mode": self.mode, "sample_rate": self.sample_rate, "max_profiles": self._profiles.maxlen,
+                "profiles": len(self._profiles)}
+
+    def profiles(self) -> list:
+        with self._lock:
+            return list(self._profiles)
+
+    def _should_sample(self, modes) -> str:
+        mode = self.mode
+        if mode not in modes or getattr(self._active, "busy", False):
+            return None
+        return mode if random.random() < self.sample_rate else None
+
+    @contextmanager
+    def profile(self, name: str, modes=("cprofile", "torch")):
+        """
+        Profile khối lệnh bên trong nếu chế độ hiện tại nằm trong `modes` và được lấy mẫu.
+        Mỗi luồng chỉ profile một khối tại một thời điểm (không lồng nhau).
+        """
+        mode = self._should_sample(modes)
+        if mode is None:
+            yield
+            return
+
+        self._active.busy = True
+        started = time.perf_counter()
+        try:
+            if mode == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    out = io.StringIO()
+                    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(self.top)
+                    report = out.getvalue()
+            else:
+                from torch.profiler import profile, ProfilerActivity
+                with profile(activities=[ProfilerActivity.CPU]) as prof:
+                    yield
+                report = prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=self.top)
+        finally:
+            self._active.busy = False
+
+        with self._lock:
+            self._profiles.append({
+                "name": name,
+                "mode": mode,
+                "thread": threading.current_thread().name,
+                "duration_ms": round(1000 * (time.perf_counter() - started), 1),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "report": report,
+            })
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware lấy mẫu cả request bằng cProfile (chỉ ở chế độ "cprofile"). Profile chạy
+    trên luồng event loop nên cũng ghi nhận các coroutine khác xen kẽ trong lúc đó; mỗi lúc
+    chỉ profile một request. Phần suy luận trên pool được profile riêng trong summarize_batch.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or profiler.mode != "cprofile" or scope["path"].startswith(("/metrics", "/debug")):
+            await self.app(scope, receive, send)
+            return
+        with profiler.profile(f"{scope['method']} {scope['path']}", modes=("cprofile",)):
+            await self.app(scope, receive, send)
+
+
+profiler = Profiler(mode=os.getenv("PROFILE_MODE", "off"),
+                    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "1.0")),
+                    max_profiles=int(os.getenv("PROFILE_MAX_PROFILES", "20")))
@@ -0,0 +1,58 @@
+# rate_limit.py
+import asyncio
+import time
+
+
+class AsyncTokenBucket:
+    """
+    Bộ giới hạn tốc độ kiểu token bucket dùng chung giữa các coroutine.
+    rate: số token nạp lại mỗi giây (<= 0: không giới hạn); capacity: số token tối đa (burst).
+    penalize() tạm dừng toàn bộ bucket, ví dụ khi upstream trả 429.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Lấy token ngay nếu có, không chờ. Trả về False nếu đã hết token."""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return False
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def retry_after(self, tokens: float = 1.0) -> float:
+        """Số giây ước tính cho đến khi có đủ token."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, (tokens - self._tokens) / self.rate)
+        return max(wait, self._blocked_until - now)
+
+    async def acquire(self, tokens: float = 1.0):
+        """Chờ (không chặn event loop) cho đến khi lấy được token. Các coroutine được phục vụ theo thứ tự."""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(max(self.retry_after(tokens), 0.001))
+
+    def penalize(self, seconds: float):
+        """Tạm dừng cấp token trong `seconds` giây và xả hết token đang có."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
@@ -1,11 +1,15 @@
 # search_agent.py
 import os
-import time
-import requests
+import asyncio
+import httpx
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 from google.genai.errors import APIError
+from rate_limit import AsyncTokenBucket
+from cache import TTLCache, SingleFlight, make_key
+from metrics import STAGE_LATENCY, UPSTREAM_LATENCY, UPSTREAM_ERRORS, UPSTREAM_RETRIES
+from admission import time_left
 
 # Load environment variables (API Key)
 load_dotenv()
@@ -18,20 +22,94 @@ except Exception as e:
     print(f"Lỗi khởi tạo Gemini Client: {e}. Vui lòng kiểm tra GOOGLE_API_KEY.")
     gemini_client = None
 
+# Model Gemini dùng cho dịch và tổng hợp
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+# Giới hạn gọi Gemini dùng chung cho cả server (token bucket theo quota, tránh 429)
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "5"))
+gemini_limiter = AsyncTokenBucket(rate=GEMINI_RPM / 60.0, capacity=GEMINI_BURST)
+
 # Serper API Key 
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
 if not SERPER_API_KEY:
     print("Cảnh báo: Không tìm thấy SERPER_API_KEY. Chức năng Agent sẽ không hoạt động.")
 
+# Cache kết quả Serper và câu trả lời tổng hợp của Agent (giây; 0 = tắt)
+SERPER_CACHE_TTL = float(os.getenv("SERPER_CACHE_TTL", "3600"))
+AGENT_ANSWER_TTL = float(os.getenv("AGENT_ANSWER_TTL", "900"))
+serper_cache = TTLCache(ttl=SERPER_CACHE_TTL, max_items=2048)
+agent_answer_cache = TTLCache(ttl=AGENT_ANSWER_TTL, max_items=1024)
+
+# Gộp các truy vấn giống nhau đang chạy đồng thời thành một lời gọi upstream
+serper_flight = SingleFlight()
+agent_flight = SingleFlight()
+
+# HTTP client dùng chung (connection pool, keep-alive) cho các lời gọi Serper
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+_http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=10,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _query_key(kind: str, query: str, **params) -> str:
+    return make_key(kind, query.lower(), **params)
+
+
+def agent_cache_stats() -> dict:
+    return {
+        "serper_cache": serper_cache.stats(),
+        "answer_cache": agent_answer_cache.stats(),
+        "serper_coalescing": serper_flight.stats(),
+        "agent_coalescing": agent_flight.stats(),
+    }
+
+
+def _status_code(e: APIError):
+    """Lấy mã HTTP từ lỗi Gemini (APIError.code), dự phòng qua e.response."""
+    code = getattr(e, 'code', None)
+    if code is None and getattr(e, 'response', None) is not None:
+        code = getattr(e.response, 'status_code', None)
+    return code
+
 
 # Hàm Tìm kiếm Serper 
-def serper_search(query: str, num_results: int = 5) -> dict:
+async def serper_search(query: str, num_results: int = 5) -> dict:
     """
-    Tìm kiếm học thuật bằng Serper API trực tiếp (dùng requests).
+    Tìm kiếm học thuật bằng Serper API (httpx bất đồng bộ, connection pool dùng chung).
+    Kết quả thành công được cache theo TTL; các truy vấn trùng đang chạy được gộp lại.
     """
     if not SERPER_API_KEY:
         return {"error": "SERPER_API_KEY không được cấu hình"}
-    
+
+    key = _query_key("serper", query, num=num_results)
+    cached = serper_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        # Lời gọi chung không mang deadline của ai (xem SingleFlight); người gọi chỉ chờ đến deadline của mình
+        return await asyncio.wait_for(serper_flight.do(key, _serper_request, query, num_results, key), time_left())
+    except asyncio.TimeoutError:
+        UPSTREAM_ERRORS.inc(upstream="serper", operation="scholar", code="deadline")
+        return {"error": "Hết thời gian chờ Serper trước deadline của request."}
+
+
+async def _serper_request(query: str, num_results: int, cache_key: str) -> dict:
     url = "https://google.serper.dev/scholar"
     headers = {
         'X-API-KEY': SERPER_API_KEY,
@@ -45,84 +123,123 @@ def serper_search(query: str, num_results: int = 5) -> dict:
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        with UPSTREAM_LATENCY.time(upstream="serper", operation="scholar"):
+            # Không chờ Serper quá deadline của request (admission)
+            response = await get_http_client().post(url, headers=headers, json=payload, timeout=time_left(10))
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        results = response.json()
+        serper_cache.set(cache_key, results)
+        return results
+    except httpx.HTTPError as e:
+        code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else type(e).__name__
+        UPSTREAM_ERRORS.inc(upstream="serper", operation="scholar", code=code)
         print(f"Lỗi khi gọi Serper API: {e}")
         return {"error": str(e)}
 
 
-# Hàm Dịch Văn bản 
-def translate_text(text: str, target_language: str = 'Vietnamese', max_retries: int = 3) -> str:
+async def _acquire_gemini():
     """
-    Dịch văn bản bằng Gemini API, có hỗ trợ Thử lại Tăng dần (Exponential Backoff)
-    cho các lỗi tạm thời như 503 UNAVAILABLE.
+    Chờ token của bộ giới hạn tốc độ Gemini (ghi lại thời gian chờ).
+    Raise asyncio.TimeoutError nếu phải chờ quá deadline của request.
     """
-    if gemini_client is None:
-        return "Lỗi: Gemini Client không khả dụng. Không thể dịch."
+    with STAGE_LATENCY.time(stage="gemini_rate_limit_wait"):
+        await asyncio.wait_for(gemini_limiter.acquire(), time_left())
 
-    system_instruction = (
-        f"Bạn là một dịch giả chuyên nghiệp. Hãy dịch văn bản sau sang ngôn ngữ {target_language}. "
-        f"Đảm bảo dịch chính xác, giữ nguyên ngữ cảnh và định dạng (ví dụ: các đoạn xuống dòng)."
-    )
-    
-    # Chia nhỏ văn bản 
-    CHUNK_SIZE = 7000 
-    chunks = [text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
-    translated_texts = []
-    
-    if not chunks:
-        return ""
-    
-    for i, chunk in enumerate(chunks):
-        
-        for attempt in range(max_retries):
-            try:
-                # 1. Gọi API 
-                response = gemini_client.models.generate_content(
-                    model='gemini-2.5-flash',
+
+def _can_wait(seconds: float) -> bool:
+    """Còn đủ thời gian (trước deadline của request) để chờ backoff rồi thử lại không."""
+    left = time_left()
+    return left is None or left > seconds
+
+
+def _record_gemini_error(operation: str, code, wait_time: float = None):
+    """Đếm lỗi Gemini theo mã; nếu sẽ thử lại thì đếm retry và thời gian backoff."""
+    UPSTREAM_ERRORS.inc(upstream="gemini", operation=operation, code=code)
+    if wait_time is not None:
+        UPSTREAM_RETRIES.inc(upstream="gemini", operation=operation)
+        STAGE_LATENCY.observe(wait_time, stage="gemini_backoff")
+
+
+# Hàm Dịch Văn bản
+async def _translate_chunk(chunk: str, index: int, system_instruction: str, max_retries: int) -> str:
+    """Dịch một khối, thử lại riêng khối này khi gặp 503/429."""
+    for attempt in range(max_retries):
+        await _acquire_gemini()
+        try:
+            with UPSTREAM_LATENCY.time(upstream="gemini", operation="translate"):
+                response = await asyncio.wait_for(gemini_client.aio.models.generate_content(
+                    model=GEMINI_MODEL,
                     contents=chunk,
                     config=types.GenerateContentConfig(
                         system_instruction=system_instruction
                     )
-                )
+                ), time_left())
+            return (response.text or "").strip()
+        except asyncio.TimeoutError:
+            _record_gemini_error("translate", "deadline")
+            print(f"Hết deadline của request khi dịch đoạn {index + 1}.")
+            raise
+        except APIError as e:
+            # Bắt các lỗi tạm thời (503, 429)
+            code = _status_code(e)
+            wait_time = 2 ** attempt # 1s, 2s, 4s
+            if code in [503, 429] and attempt < max_retries - 1 and _can_wait(wait_time):
+                _record_gemini_error("translate", code, wait_time)
+                if code == 429:
+                    # Hết quota: dừng cả bucket để các khối khác không dồn thêm request
+                    gemini_limiter.penalize(wait_time)
+                print(f"Lỗi API {code} (Quá tải/Throttled) ở đoạn {index + 1}. Đang thử lại sau {wait_time} giây... (Lần {attempt + 1}/{max_retries})")
+                await asyncio.sleep(wait_time)
+            else:
+                _record_gemini_error("translate", code)
+                print(f"Lỗi API nghiêm trọng khi dịch đoạn {index + 1}: {e}")
+                raise
 
-                # 2. Xử lý kết quả và thoát vòng lặp thử lại
-                translated_texts.append(response.text)
-                break
-            except APIError as e:
-                # Bắt các lỗi tạm thời (503, 429)
-                if e.response.status_code in [503, 429] and attempt < max_retries - 1:
-                    wait_time = 2 ** attempt # 1s, 2s, 4s
-                    print(f"Lỗi API {e.response.status_code} (Quá tải/Throttled). Đang thử lại sau {wait_time} giây... (Lần {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
-                else:
-                    print(f"Lỗi API nghiêm trọng khi dịch đoạn {i + 1}: {e}")
-                    return f"Lỗi dịch API: {e}. Vui lòng kiểm tra GOOGLE_API_KEY hoặc thử lại sau."
-            
-            except Exception as e:
-                print(f"Lỗi không xác định khi dịch đoạn {i + 1}: {e}")
-                return f"Lỗi không xác định: {e}"
 
-    return ' '.join(translated_texts)
+async def translate_chunk(chunk: str, index: int = 0, target_language: str = 'Vietnamese',
+                          max_retries: int = 3) -> str:
+    """
+    Dịch một khối văn bản bằng Gemini (backend "gemini" của translation.py).
+    Raise APIError nếu vẫn lỗi sau khi thử lại, RuntimeError nếu không có client.
+    """
+    if gemini_client is None:
+        raise RuntimeError("Gemini Client không khả dụng.")
+    system_instruction = (
+        f"Bạn là một dịch giả chuyên nghiệp. Hãy dịch văn bản sau sang ngôn ngữ {target_language}. "
+        f"Đảm bảo dịch chính xác, giữ nguyên ngữ cảnh và định dạng (ví dụ: các đoạn xuống dòng)."
+    )
+    return await _translate_chunk(chunk, index, system_instruction, max_retries)
 
 
 # Hàm RAG Agent 
-def rag_agent(query: str, max_retries: int = 3) -> str:
+async def rag_agent(query: str, max_retries: int = 3) -> str:
     """
     Sử dụng Serper để tìm kiếm học thuật và Gemini để tổng hợp thông tin, 
     cung cấp kết quả chi tiết kèm trích dẫn nguồn.
     Có cơ chế retry cho lỗi 503 (overloaded).
+    Câu trả lời thành công được cache theo TTL; các truy vấn giống nhau đến cùng lúc
+    chỉ tạo một lượt gọi Serper + Gemini và dùng chung kết quả.
     """
     if gemini_client is None:
         return "Lỗi: Gemini Client không khả dụng. Vui lòng kiểm tra GOOGLE_API_KEY."
     if not SERPER_API_KEY:
         return "Lỗi: SERPER_API_KEY không được cấu hình. Agent không thể tìm kiếm."
 
+    key = _query_key("agent", query, model=GEMINI_MODEL)
+    cached = agent_answer_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        return await asyncio.wait_for(agent_flight.do(key, _run_rag_agent, query, max_retries, key), time_left())
+    except asyncio.TimeoutError:
+        _record_gemini_error("agent", "deadline")
+        return "Lỗi: Hết thời gian chờ Gemini trước deadline của request. Vui lòng thử lại sau."
+
+
+async def _run_rag_agent(query: str, max_retries: int, cache_key: str) -> str:
     try:
         # 1. Thực hiện tìm kiếm học thuật bằng Serper
-        search_results = serper_search(query, num_results=10)
+        search_results = await serper_search(query, num_results=10)
         
         # Kiểm tra lỗi
         if "error" in search_results:
@@ -161,29 +278,36 @@ def rag_agent(query: str, max_retries: int = 3) -> str:
         # VÒNG LẶP RETRY CHO GEMINI API
         response_text = None
         for attempt in range(max_retries):
+            await _acquire_gemini()
             try:
-                response = gemini_client.models.generate_content(
-                    model='gemini-2.5-flash',
-                    contents=user_prompt,
-                    config=types.GenerateContentConfig(
-                        system_instruction=system_prompt,
-                        temperature=0.1
-                    )
-                )
+                with UPSTREAM_LATENCY.time(upstream="gemini", operation="agent"):
+                    response = await asyncio.wait_for(gemini_client.aio.models.generate_content(
+                        model=GEMINI_MODEL,
+                        contents=user_prompt,
+                        config=types.GenerateContentConfig(
+                            system_instruction=system_prompt,
+                            temperature=0.1
+                        )
+                    ), time_left())
                 response_text = response.text
                 break  
                 
             except APIError as e:
                 # Kiểm tra lỗi 503 hoặc 429
-                if hasattr(e, 'response') and e.response.status_code in [503, 429]:
-                    if attempt < max_retries - 1:
-                        wait_time = (2 ** attempt) + 1  # 2s, 5s, 9s
+                if _status_code(e) in [503, 429]:
+                    wait_time = (2 ** attempt) + 1  # 2s, 3s, 5s
+                    if attempt < max_retries - 1 and _can_wait(wait_time):
+                        _record_gemini_error("agent", _status_code(e), wait_time)
+                        if _status_code(e) == 429:
+                            gemini_limiter.penalize(wait_time)
                         print(f" Gemini quá tải (503/429). Thử lại sau {wait_time}s... (Lần {attempt + 1}/{max_retries})")
-                        time.sleep(wait_time)
+                        await asyncio.sleep(wait_time)
                     else:
+                        _record_gemini_error("agent", _status_code(e))
                         return f" Gemini API vẫn quá tải sau {max_retries} lần thử. Vui lòng thử lại sau vài phút."
                 else:
                     # Lỗi khác không thể retry
+                    _record_gemini_error("agent", _status_code(e))
                     raise e
         
         if response_text is None:
@@ -194,8 +318,13 @@ def rag_agent(query: str, max_retries: int = 3) -> str:
         for source in sources:
              source_markdown += f"- [[{source['index']}]] [{source['title']}]({source['link']})\n"
         
-        return response_text + source_markdown
+        answer = response_text + source_markdown
+        agent_answer_cache.set(cache_key, answer)
+        return answer
     
+    except asyncio.TimeoutError:
+        _record_gemini_error("agent", "deadline")
+        return "Lỗi: Hết thời gian chờ Gemini trước deadline của request. Vui lòng thử lại sau."
     except APIError as e:
         return f"Lỗi API Gemini trong Agent: {e}. Vui lòng kiểm tra GOOGLE_API_KEY hoặc thử lại sau."
     except Exception as e:
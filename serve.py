@@ -0,0 +1,163 @@
+# serve.py
+"""
+Chạy server nhiều tiến trình worker dùng chung trọng số model (pre-fork).
+
+- Tiến trình cha nạp model tóm tắt (và mô hình dịch local, profile langdetect) MỘT lần,
+  mở socket lắng nghe rồi fork SERVE_WORKERS worker. Worker chỉ đọc trọng số nên các trang
+  nhớ được chia sẻ copy-on-write với tiến trình cha: RAM gần như không tăng theo số worker
+  (khác với `uvicorn --workers N`, mỗi worker tự gọi load_model và giữ một bản sao riêng).
+- gc.freeze() trước khi fork để bộ thu gom rác không ghi lên (và làm sao chép) các trang nhớ
+  chứa đối tượng Python đã nạp.
+- Mỗi worker dùng torch.set_num_threads(SERVE_THREADS_PER_WORKER), mặc định số lõi / số
+  worker, để các worker không tranh nhau CPU. Quota Gemini được chia đều cho các worker.
+- Worker bị chết được fork lại từ tiến trình cha, không phải nạp lại model.
+
+Với SERVE_WORKERS=1 (mặc định) server chạy như `uvicorn main:app`: cổng mở ngay và model
+được nạp nền (MODEL_PRELOAD), không fork.
+
+Lưu ý: cache kết quả trong RAM, bộ gom lô và /metrics là riêng của từng worker
+(tầng cache SQLite, nếu bật RESULT_CACHE_DB, dùng chung).
+
+Cách chạy:
+    python serve.py --workers 4 --host 0.0.0.0 --port 8080
+"""
+import argparse
+import gc
+import os
+import random
+import signal
+import sys
+import time
+import traceback
+
+import torch
+import uvicorn
+
+import main
+import translation
+from language_id import get_factory
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+SERVE_THREADS_PER_WORKER = int(os.getenv("SERVE_THREADS_PER_WORKER", "0"))  # 0: số lõi / số worker
+# Chờ tối thiểu giữa hai lần fork lại cùng một worker (tránh vòng lặp crash liên tục)
+SERVE_RESTART_DELAY_S = float(os.getenv("SERVE_RESTART_DELAY_S", "1.0"))
+
+
+def threads_per_worker(workers: int, requested: int = 0) -> int:
+    if requested > 0:
+        return requested
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def preload():
+    """Nạp mọi thứ dùng chung (chỉ đọc) trong tiến trình cha, trước khi fork."""
+    started = time.perf_counter()
+    if not main.preload_model():
+        print("CẢNH BÁO: Không tải được model tóm tắt; các worker vẫn chạy nhưng /summarize sẽ lỗi.")
+    if translation.TRANSLATION_ROUTING != "gemini":
+        translation.local_translator.load()
+    get_factory()
+    # Đưa mọi đối tượng hiện có vào thế hệ "vĩnh viễn": GC của worker không duyệt (ghi) lên chúng nữa
+    gc.collect()
+    gc.freeze()
+    print(f"Tiến trình cha đã nạp xong sau {time.perf_counter() - started:.2f}s; bắt đầu fork worker.")
+
+
+def run_worker(sock, index: int, workers: int, threads: int, config_kwargs: dict):
+    """Thân của một worker (chạy trong tiến trình con vừa fork)."""
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+    # Các worker không dùng chung trạng thái ngẫu nhiên của tiến trình cha (lấy mẫu top-p, profiling)
+    random.seed()
+    torch.seed()
+    main.reinit_after_fork()
+    if main.AGENT_AVAILABLE and workers > 1:
+        import search_agent
+        search_agent.gemini_limiter = search_agent.AsyncTokenBucket(
+            search_agent.GEMINI_RPM / 60.0 / workers, max(1.0, search_agent.GEMINI_BURST / workers))
+    print(f"Worker {index} (pid {os.getpid()}) sẵn sàng với {threads} luồng torch.")
+    server = uvicorn.Server(uvicorn.Config(main.app, **config_kwargs))
+    server.run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int, threads: int, log_level: str = "info"):
+    config_kwargs = dict(host=host, port=port, log_level=log_level)
+    if workers == 1:
+        # Một worker: chạy thẳng như `uvicorn main:app` để cổng mở và /health trả lời ngay,
+        # model được nạp nền trong lifespan (MODEL_PRELOAD) thay vì chặn trước khi bind
+        torch.set_num_threads(threads)
+        uvicorn.run(main.app, **config_kwargs)
+        return
+
+    # Mở cổng trước khi nạp model để nền tảng (Render, Cloud Run) thấy cổng đã lắng nghe;
+    # kết nối đến sớm nằm chờ trong backlog cho đến khi worker đầu tiên sẵn sàng
+    sock = uvicorn.Config(main.app, **config_kwargs).bind_socket()
+    preload()
+
+    children = {}  # pid -> chỉ số worker
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock, index, workers, threads, config_kwargs)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        spawn(index)
+
+    last_restart = {}
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"Worker {index} (pid {pid}) đã dừng với mã {os.waitstatus_to_exitcode(status)}. Khởi động lại...")
+        delay = SERVE_RESTART_DELAY_S - (time.monotonic() - last_restart.get(index, 0.0))
+        if delay > 0:
+            time.sleep(delay)
+        last_restart[index] = time.monotonic()
+        spawn(index)
+    sock.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS_PER_WORKER,
+                        help="Số luồng torch mỗi worker (0: số lõi / số worker)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py cần os.fork (Linux/macOS). Trên Windows hãy chạy: uvicorn main:app")
+    workers = max(1, args.workers)
+    serve(args.host, args.port, workers, threads_per_worker(workers, args.threads), args.log_level)
+
+
+if __name__ == "__main__":
+    main_cli()
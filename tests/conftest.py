@@ -0,0 +1,6 @@
+# tests/conftest.py
+# Cho phép import các module ở thư mục gốc của repo (main.py, admission.py...) khi chạy `pytest`.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
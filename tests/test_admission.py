@@ -0,0 +1,63 @@
+# tests/test_admission.py
+import asyncio
+import json
+import time
+
+import admission
+
+
+async def _slow_app(scope, receive, send):
+    await asyncio.sleep(0.2)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def _call(app, path="/summarize"):
+    """Gọi middleware như một client ASGI; trả về (status, headers, body, thời gian)."""
+    messages = []
+
+    async def receive():
+        await asyncio.sleep(10)  # Client không ngắt kết nối
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    started = time.monotonic()
+    await app({"type": "http", "path": path, "headers": [], "client": ("1.2.3.4", 1)}, receive, send)
+    start = next(m for m in messages if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return start["status"], dict(start["headers"]), body, time.monotonic() - started
+
+
+def test_burst_beyond_queue_is_rejected_immediately(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CLIENT_RPM", 0)
+    monkeypatch.setattr(admission, "classes", admission.build_classes("generate=1:1:5"))
+    app = admission.AdmissionMiddleware(_slow_app)
+
+    async def burst():
+        return await asyncio.gather(*(_call(app) for _ in range(10)))
+
+    results = asyncio.run(burst())
+    served = [r for r in results if r[0] == 200]
+    rejected = [r for r in results if r[0] == 503]
+    # 1 request chạy + 1 request chờ; 8 request còn lại bị từ chối ngay, không chờ hết timeout
+    assert len(served) == 2 and len(rejected) == 8
+    assert all(elapsed < 0.1 for *_, elapsed in rejected)
+    assert all(b"retry-after" in headers for _, headers, _, _ in rejected)
+    assert all("quá tải" in json.loads(body)["error"] for _, _, body, _ in rejected)
+    stats = admission.classes["generate"].stats()
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+def test_queue_timeout_releases_reserved_slot(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CLIENT_RPM", 0)
+    monkeypatch.setattr(admission, "classes", admission.build_classes("generate=1:4:0.05"))
+    app = admission.AdmissionMiddleware(_slow_app)
+
+    async def burst():
+        return await asyncio.gather(*(_call(app) for _ in range(3)))
+
+    statuses = sorted(status for status, *_ in asyncio.run(burst()))
+    assert statuses == [200, 503, 503]
+    assert admission.classes["generate"].waiting == 0
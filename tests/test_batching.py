@@ -0,0 +1,72 @@
+# tests/test_batching.py
+import asyncio
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_concurrent_submits_are_batched_and_results_routed_back():
+    calls = []
+
+    def process(items):
+        calls.append(list(items))
+        return [item * 10 for item in items]
+
+    async def run():
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=50)
+        return batcher, await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+
+    batcher, results = asyncio.run(run())
+    assert results == [i * 10 for i in range(10)]
+    assert [len(batch) for batch in calls] == [4, 4, 2]
+    stats = batcher.stats()
+    assert stats["batches"] == 3 and stats["items"] == 10 and stats["batch_size_histogram"] == {2: 1, 4: 2}
+
+
+def test_batch_closes_after_max_wait():
+    async def run():
+        batcher = MicroBatcher(lambda items: items, max_batch_size=8, max_wait_ms=10)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert await batcher.submit("x") == "x"
+        return loop.time() - started
+
+    assert asyncio.run(run()) < 0.5
+
+
+def test_errors_and_wrong_result_counts_reach_every_caller():
+    def fail(items):
+        raise ValueError("hỏng")
+
+    async def run(process):
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=20)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        return batcher, results
+
+    batcher, results = asyncio.run(run(fail))
+    assert all(isinstance(r, ValueError) for r in results) and batcher.stats()["errors"] == 1
+
+    _, results = asyncio.run(run(lambda items: items[:-1]))
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_cancelled_callers_are_skipped_and_reported_to_process_batch():
+    seen = []
+
+    def process(items, cancelled):
+        seen.append((list(items), [c() for c in cancelled]))
+        return list(items)
+
+    async def run():
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=50, cancellable=True)
+        gone = asyncio.ensure_future(batcher.submit("gone"))
+        kept = asyncio.ensure_future(batcher.submit("kept"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        return await kept
+
+    assert asyncio.run(run()) == "kept"
+    assert seen == [(["kept"], [False])]
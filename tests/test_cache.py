@@ -0,0 +1,112 @@
+# tests/test_cache.py
+import asyncio
+import threading
+import time
+
+import admission
+from cache import ResultCache, SingleFlight, TTLCache
+
+
+def test_single_flight_call_does_not_inherit_first_callers_deadline():
+    flight = SingleFlight()
+    seen = []
+
+    async def upstream():
+        seen.append(admission.time_left())
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def caller(timeout):
+        # Mỗi người gọi chạy trong task riêng nên deadline (contextvar) là của riêng nó
+        if timeout is not None:
+            admission._deadline.set(time.monotonic() + timeout)
+        else:
+            await asyncio.sleep(0.005)  # Đến sau: gộp vào lời gọi của người gọi đầu tiên
+        try:
+            return await asyncio.wait_for(flight.do("q", upstream), admission.time_left())
+        except asyncio.TimeoutError:
+            return "timeout"
+
+    async def run():
+        # Người gọi đầu tiên có deadline rất ngắn; người gọi sau không có deadline
+        return await asyncio.gather(caller(0.01), caller(None))
+
+    assert asyncio.run(run()) == ["timeout", "ok"]
+    assert seen == [None]
+    assert flight.stats()["calls"] == 1 and flight.stats()["coalesced"] == 1
+
+
+def test_result_cache_disk_tier_runs_off_the_event_loop(tmp_path):
+    db = str(tmp_path / "results.sqlite3")
+    threads = []
+
+    class Recording(ResultCache):
+        def get(self, key):
+            threads.append(threading.get_ident())
+            return super().get(key)
+
+    async def run():
+        await ResultCache(db_path=db).aset("k", "v")
+        # Instance mới: tầng RAM rỗng nên phải đọc từ SQLite
+        cache = Recording(db_path=db)
+        assert await cache.aget("k") == "v"
+        assert await cache.aget("k") == "v"  # Lần hai trúng tầng RAM
+        assert await cache.aget("missing") is None
+        stats = await cache.astats()
+        return cache, stats
+
+    cache, stats = asyncio.run(run())
+    assert threads and threading.get_ident() not in threads
+    assert (stats["hits"], stats["disk_hits"], stats["misses"], stats["disk_items"]) == (2, 1, 1, 1)
+    # last_access của lần đọc trúng đĩa được gom lại, ghi cùng lần set() kế tiếp
+    assert "k" in cache._touched
+    cache.set("k2", "v2")
+    assert not cache._touched
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(ttl=10, max_items=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" giờ là mục ít dùng gần đây nhất
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("c") == 3
+    now[0] += 11
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["expirations"]) == (2, 2, 1, 1)
+
+    disabled = TTLCache(ttl=0)
+    disabled.set("a", 1)
+    assert disabled.get("a") is None
+
+
+def test_single_flight_coalesces_and_cancels_only_when_every_waiter_leaves():
+    flight = SingleFlight()
+    started = []
+
+    async def upstream(value):
+        started.append(value)
+        await asyncio.sleep(0.05)
+        return value
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("q", upstream, "x") for _ in range(5)))
+        assert results == ["x"] * 5 and started == ["x"]
+
+        first = asyncio.ensure_future(flight.do("k", upstream, "y"))
+        second = asyncio.ensure_future(flight.do("k", upstream, "y"))
+        await asyncio.sleep(0.01)
+        first.cancel()  # Còn người chờ thứ hai: lời gọi chung vẫn chạy tiếp
+        assert await second == "y"
+
+        lone = asyncio.ensure_future(flight.do("z", upstream, "z"))
+        await asyncio.sleep(0.01)
+        lone.cancel()
+        await asyncio.gather(lone, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert flight.stats() == {"calls": 3, "coalesced": 5, "inflight": 0, "abandoned": 1}
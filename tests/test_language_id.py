@@ -0,0 +1,23 @@
+# tests/test_language_id.py
+from language_id import identify_language
+
+
+def test_english_with_vietnamese_names_is_not_short_circuited():
+    text = ("Professor Nguyễn Thị Hương from Hà Nội Medical University presented new findings "
+            "on dengue fever prevention at the conference.")
+    result = identify_language(text)
+    assert result["language"] == "en" and not result["is_vietnamese"]
+    assert result["method"] == "langdetect"
+
+
+def test_vietnamese_prose_uses_diacritics_with_measured_ratio():
+    text = ("Theo Bộ Y tế, số ca mắc sốt xuất huyết trong tuần qua tăng mạnh tại nhiều tỉnh phía Nam. "
+            "Người dân cần chủ động diệt lăng quăng.")
+    result = identify_language(text)
+    assert result["is_vietnamese"] and result["method"] == "diacritics"
+    assert 0.12 <= result["confidence"] < 0.5
+
+
+def test_short_vietnamese_falls_through_to_langdetect():
+    result = identify_language("Xin chào các bạn")
+    assert result["is_vietnamese"] and result["method"] == "langdetect"
@@ -0,0 +1,28 @@
+# tests/test_metrics.py
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import admission
+from metrics import HTTP_REQUESTS, MetricsMiddleware
+
+
+def test_admission_rejections_are_counted_under_the_route_template(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CLIENT_RPM", 0)
+    monkeypatch.setattr(admission, "classes", admission.build_classes("light=1:0:5"))
+    app = FastAPI()
+    app.add_middleware(admission.AdmissionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+
+    @app.post("/detect_language")
+    async def detect_language():
+        return {}
+
+    key = ("POST", "/detect_language", "503")
+    before = HTTP_REQUESTS._values.get(key, 0.0)
+    # Chiếm chỗ duy nhất của nhóm "light" để request sau bị admission từ chối trước router
+    admission.classes["light"].in_flight = 1
+    with TestClient(app) as client:
+        assert client.post("/detect_language").status_code == 503
+    admission.classes["light"].in_flight = 0
+    assert HTTP_REQUESTS._values.get(key, 0.0) == before + 1
+    assert ("POST", "unmatched", "503") not in HTTP_REQUESTS._values
@@ -0,0 +1,44 @@
+# tests/test_rate_limit.py
+import asyncio
+import time
+
+from rate_limit import AsyncTokenBucket
+
+
+def test_burst_up_to_capacity_then_refills_at_rate(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    bucket = AsyncTokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert bucket.retry_after() == 0.5
+    now[0] += 0.5
+    assert bucket.try_acquire() and not bucket.try_acquire()
+    now[0] += 100  # Không nạp vượt quá capacity
+    assert sum(bucket.try_acquire() for _ in range(5)) == 3
+
+
+def test_penalize_blocks_and_drains(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    bucket = AsyncTokenBucket(rate=10, capacity=5)
+    bucket.penalize(2)
+    assert not bucket.try_acquire() and bucket.retry_after() == 2
+    now[0] += 2
+    assert bucket.try_acquire()  # Đã nạp lại 5 token trong lúc bị tạm dừng (tối đa capacity)
+
+
+def test_zero_rate_is_unlimited():
+    bucket = AsyncTokenBucket(rate=0)
+    assert all(bucket.try_acquire() for _ in range(1000)) and bucket.retry_after() == 0.0
+
+
+def test_acquire_waits_for_refill():
+    async def run():
+        bucket = AsyncTokenBucket(rate=50, capacity=1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(bucket.acquire() for _ in range(4)))
+        return loop.time() - started
+
+    # 1 token có sẵn, 3 token còn lại nạp ở tốc độ 50/s (~60 ms)
+    assert 0.04 < asyncio.run(run()) < 1.0
@@ -0,0 +1,42 @@
+# tests/test_text_chunking.py
+import random
+
+from text_chunking import chunk_text
+
+_ALPHABET = ["a", "b", "ư", "đ", "ệ", " ", " ", "  ", "\t", "\n", "\n\n", "\n \n", ".", "!", "…", "?"]
+
+
+def _random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 200)))
+
+
+def test_chunks_join_back_to_the_original_text():
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = _random_text(rng)
+        max_size = rng.randint(1, 40)
+        chunks = chunk_text(text, max_size)
+        assert "".join(chunk + sep for chunk, sep in chunks) == text
+        assert all(chunk for chunk, _ in chunks)
+
+
+def test_chunks_respect_max_size_when_every_word_fits():
+    rng = random.Random(1)
+    for _ in range(500):
+        words = ["".join(rng.choice("abcđư") for _ in range(rng.randint(1, 6))) + rng.choice(["", ".", "!"])
+                 for _ in range(rng.randint(1, 60))]
+        text = "".join(word + rng.choice([" ", "\n", "\n\n", " \n "]) for word in words)
+        max_size = rng.randint(7, 50)
+        for chunk, _ in chunk_text(text, max_size):
+            assert len(chunk) <= max_size
+
+
+def test_leading_separator_is_kept():
+    assert chunk_text("aaa.\n\n bbb ccc", 5) == [("aaa.", "\n\n "), ("bbb", " "), ("ccc", "")]
+    assert "".join(c + s for c, s in chunk_text("\n\n xxx yyy", 5)) == "\n\n xxx yyy"
+
+
+def test_prefers_paragraph_boundaries_and_counts_with_length_fn():
+    text = "một hai ba.\n\nbốn năm sáu bảy."
+    chunks = chunk_text(text, 4, length_fn=lambda s: len(s.split()))
+    assert chunks == [("một hai ba.", "\n\n"), ("bốn năm sáu bảy.", "")]
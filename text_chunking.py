@@ -0,0 +1,73 @@
+# text_chunking.py
+import re
+
+# Thứ tự ưu tiên điểm cắt: đoạn văn -> dòng -> câu -> từ
+_SEPARATORS = [r"\n\s*\n", r"\n", r"(?<=[.!?…])\s+", r"\s+"]
+
+
+def _segments(text: str, max_size: int, length_fn, level: int = 0) -> tuple:
+    """
+    Tách đệ quy văn bản thành các mảnh (piece, separator) sao cho mỗi mảnh
+    không vượt quá max_size, ưu tiên cắt ở ranh giới lớn hơn trước.
+    separator là khoảng trắng gốc đứng ngay sau mảnh (giữ nguyên xuống dòng).
+    Trả về (lead, segments): lead là khoảng trắng đứng trước mảnh đầu tiên, người gọi
+    nối nó vào separator của mảnh đứng trước (nếu có) để không mất ký tự nào.
+    """
+    if level >= len(_SEPARATORS) or length_fn(text) <= max_size:
+        return "", [(text, "")]
+
+    parts = re.split(f"({_SEPARATORS[level]})", text)
+    lead, out = "", []
+
+    def attach(extra: str):
+        # Khoảng trắng không đi kèm mảnh nào: nối vào separator của mảnh trước, hoặc vào lead
+        nonlocal lead
+        if out:
+            out[-1] = (out[-1][0], out[-1][1] + extra)
+        else:
+            lead += extra
+
+    for i in range(0, len(parts), 2):
+        piece = parts[i]
+        sep = parts[i + 1] if i + 1 < len(parts) else ""
+        if piece:
+            sub_lead, sub = _segments(piece, max_size, length_fn, level + 1)
+            attach(sub_lead)
+            sub[-1] = (sub[-1][0], sub[-1][1] + sep)
+            out.extend(sub)
+        else:
+            attach(sep)
+    return (lead, out) if out else ("", [(text, "")])
+
+
+def chunk_text(text: str, max_size: int, length_fn=len) -> list:
+    """
+    Chia văn bản thành các khối (chunk, separator) có kích thước <= max_size
+    theo length_fn (mặc định: số ký tự; có thể truyền hàm đếm token).
+    Chỉ cắt ở ranh giới đoạn/câu/từ. Ghép lại bằng
+    "".join(chunk + sep for chunk, sep in chunks) sẽ được đúng văn bản gốc; khoảng trắng
+    ở đầu văn bản (nếu có) nằm ở đầu khối đầu tiên và không tính vào max_size.
+    """
+    if not text:
+        return []
+
+    chunks = []
+    current, current_len, current_sep = "", 0, ""
+    lead, segments = _segments(text, max_size, length_fn)
+    for piece, sep in segments:
+        piece_len = length_fn(piece)
+        sep_len = length_fn(current_sep) if current and current_sep else 0
+        if current and current_len + sep_len + piece_len > max_size:
+            chunks.append((current, current_sep))
+            current, current_len = piece, piece_len
+        elif current:
+            current += current_sep + piece
+            current_len += sep_len + piece_len
+        else:
+            current, current_len = piece, piece_len
+        current_sep = sep
+    if current:
+        chunks.append((current, current_sep))
+    if lead and chunks:
+        chunks[0] = (lead + chunks[0][0], chunks[0][1])
+    return chunks
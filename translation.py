@@ -0,0 +1,233 @@
+# translation.py
+"""
+Dịch văn bản sang tiếng Việt qua các backend cắm được:
+- "local":  mô hình seq2seq en→vi chạy trên CPU (mặc định Helsinki-NLP/opus-mt-en-vi).
+  Mỗi khối được tách theo câu; các câu của mọi request được gom lô (MicroBatcher) và
+  dịch trong một lần model.generate trên pool luồng riêng, không phụ thuộc quota bên ngoài.
+- "gemini": Gemini API (search_agent.translate_chunk), có token bucket và backoff.
+
+Định tuyến (TRANSLATION_ROUTING):
+- "local_first" (mặc định): dịch local, khối nào lỗi thì dịch lại bằng Gemini
+- "gemini_first": Gemini trước, dùng local khi Gemini lỗi (hết quota, 503...)
+- "local" / "gemini": chỉ dùng một backend
+- "size": văn bản tối đa TRANSLATION_LOCAL_MAX_CHARS ký tự dịch local trước, dài hơn
+  thì Gemini trước (tránh chiếm CPU của tóm tắt quá lâu)
+Backend local chỉ nhận văn bản có ngôn ngữ nguồn trong TRANSLATION_LOCAL_SOURCES.
+"""
+import asyncio
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+import metrics
+from batching import MicroBatcher
+from metrics import stage_timer
+from text_chunking import chunk_text
+
+try:
+    import search_agent
+    GEMINI_AVAILABLE = True
+except ImportError:
+    search_agent = None
+    GEMINI_AVAILABLE = False
+
+ROUTINGS = ("local_first", "gemini_first", "local", "gemini", "size")
+TRANSLATION_ROUTING = os.getenv("TRANSLATION_ROUTING", "local_first").lower()
+if TRANSLATION_ROUTING not in ROUTINGS:
+    print(f"TRANSLATION_ROUTING không hợp lệ: {TRANSLATION_ROUTING}. Dùng 'local_first'.")
+    TRANSLATION_ROUTING = "local_first"
+
+# Dịch song song: kích thước khối (ký tự) và số khối dịch đồng thời mỗi request
+TRANSLATE_CHUNK_SIZE = int(os.getenv("TRANSLATE_CHUNK_SIZE", "7000"))
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "4"))
+
+# Mô hình dịch local. Với mô hình cần tiền tố (ví dụ VietAI/envit5-translation: "en: "),
+# đặt TRANSLATION_LOCAL_PREFIX; tiền tố "vi:" ở đầu ra được bỏ đi.
+TRANSLATION_LOCAL_MODEL = os.getenv("TRANSLATION_LOCAL_MODEL", "Helsinki-NLP/opus-mt-en-vi")
+TRANSLATION_LOCAL_PREFIX = os.getenv("TRANSLATION_LOCAL_PREFIX", "")
+TRANSLATION_LOCAL_SOURCES = tuple(s.strip() for s in os.getenv("TRANSLATION_LOCAL_SOURCES", "en").split(",") if s.strip())
+TRANSLATION_LOCAL_MAX_CHARS = int(os.getenv("TRANSLATION_LOCAL_MAX_CHARS", "20000"))  # Ngưỡng của routing "size"
+TRANSLATION_LOCAL_SEGMENT_CHARS = int(os.getenv("TRANSLATION_LOCAL_SEGMENT_CHARS", "400"))  # Độ dài tối đa một câu/đoạn
+TRANSLATION_LOCAL_BATCH_SIZE = int(os.getenv("TRANSLATION_LOCAL_BATCH_SIZE", "16"))
+TRANSLATION_LOCAL_BATCH_WAIT_MS = float(os.getenv("TRANSLATION_LOCAL_BATCH_WAIT_MS", "5"))
+TRANSLATION_LOCAL_BEAMS = int(os.getenv("TRANSLATION_LOCAL_BEAMS", "1"))
+TRANSLATION_LOCAL_MAX_NEW_TOKENS = int(os.getenv("TRANSLATION_LOCAL_MAX_NEW_TOKENS", "256"))
+TRANSLATION_LOCAL_WORKERS = int(os.getenv("TRANSLATION_LOCAL_WORKERS", "1"))
+
+_OUTPUT_PREFIX = re.compile(r"^\s*vi:\s*")
+
+TRANSLATED_CHUNKS = metrics.counter("chatbot_translation_chunks_total",
+                                    "Số khối đã dịch theo backend và kết quả (ok, error).",
+                                    ("backend", "outcome"))
+
+
+class LocalTranslator:
+    """Mô hình dịch seq2seq nạp lười (một lần, an toàn giữa các luồng) trên pool luồng riêng."""
+
+    def __init__(self, model_name: str = TRANSLATION_LOCAL_MODEL):
+        self.model_name = model_name
+        self.model = None
+        self.tokenizer = None
+        self.error = None  # Lỗi khi nạp: không thử nạp lại cho đến khi khởi động lại server
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=TRANSLATION_LOCAL_WORKERS, thread_name_prefix="translate")
+        self.batcher = MicroBatcher(self.translate_batch, max_batch_size=TRANSLATION_LOCAL_BATCH_SIZE,
+                                    max_wait_ms=TRANSLATION_LOCAL_BATCH_WAIT_MS, executor=self.executor,
+                                    name="translate_local")
+
+    @property
+    def available(self) -> bool:
+        return self.error is None
+
+    def status(self) -> str:
+        if self.error is not None:
+            return "error"
+        return "ready" if self.model is not None else "not_loaded"
+
+    def load(self) -> bool:
+        if self.model is not None or self.error is not None:
+            return self.error is None
+        with self._lock:
+            if self.model is None and self.error is None:
+                try:
+                    with stage_timer("translate_local_load"):
+                        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                        model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name).eval()
+                    self.tokenizer, self.model = tokenizer, model
+                    print(f"Đã nạp mô hình dịch local: {self.model_name}")
+                except Exception as e:
+                    self.error = str(e)
+                    print(f"Không nạp được mô hình dịch local {self.model_name}: {e}")
+        return self.error is None
+
+    def translate_batch(self, segments):
+        """Dịch một lô câu trong MỘT lần model.generate. Trả về bản dịch theo đúng thứ tự."""
+        if not self.load():
+            raise RuntimeError(f"Mô hình dịch local không khả dụng: {self.error}")
+        inputs = self.tokenizer([TRANSLATION_LOCAL_PREFIX + s for s in segments], return_tensors="pt",
+                                padding=True, truncation=True, max_length=512)
+        with stage_timer("translate_local_generate"), torch.inference_mode():
+            output_ids = self.model.generate(**inputs, num_beams=TRANSLATION_LOCAL_BEAMS,
+                                             max_new_tokens=TRANSLATION_LOCAL_MAX_NEW_TOKENS)
+        decoded = self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+        return [_OUTPUT_PREFIX.sub("", text).strip() for text in decoded]
+
+    async def translate_chunk(self, chunk: str) -> str:
+        """Tách khối theo câu, gửi từng câu vào bộ gom lô rồi ghép lại với khoảng trắng gốc."""
+        segments = chunk_text(chunk, TRANSLATION_LOCAL_SEGMENT_CHARS)
+        results = await asyncio.gather(*(self.batcher.submit(segment) for segment, _ in segments))
+        return "".join(translated + sep for translated, (_, sep) in zip(results, segments)).strip()
+
+
+local_translator = LocalTranslator()
+
+
+def gemini_ready() -> bool:
+    return GEMINI_AVAILABLE and search_agent.gemini_client is not None
+
+
+def translation_available() -> bool:
+    """Có ít nhất một backend dùng được (chưa biết ngôn ngữ nguồn)."""
+    return bool(route(""))
+
+
+def route(text: str, target_language: str = 'Vietnamese', source_language: str = None) -> list:
+    """Danh sách backend sẽ thử theo thứ tự cho văn bản này (rỗng nếu không có backend nào)."""
+    if TRANSLATION_ROUTING == "size":
+        order = ["local", "gemini"] if len(text) <= TRANSLATION_LOCAL_MAX_CHARS else ["gemini", "local"]
+    elif TRANSLATION_ROUTING == "gemini_first":
+        order = ["gemini", "local"]
+    elif TRANSLATION_ROUTING in ("local", "gemini"):
+        order = [TRANSLATION_ROUTING]
+    else:
+        order = ["local", "gemini"]
+
+    local_ok = (local_translator.available and target_language == 'Vietnamese'
+                and (source_language is None or source_language in TRANSLATION_LOCAL_SOURCES))
+    usable = {"local": local_ok, "gemini": gemini_ready()}
+    return [backend for backend in order if usable[backend]]
+
+
+def cache_params() -> dict:
+    """Các tham số ảnh hưởng đến bản dịch (đưa vào khoá cache)."""
+    return {"routing": TRANSLATION_ROUTING, "local_model": TRANSLATION_LOCAL_MODEL,
+            "gemini_model": search_agent.GEMINI_MODEL if GEMINI_AVAILABLE else None}
+
+
+def status() -> dict:
+    return {"routing": TRANSLATION_ROUTING, "local_model": TRANSLATION_LOCAL_MODEL,
+            "local": local_translator.status(), "local_error": local_translator.error,
+            "gemini": gemini_ready()}
+
+
+async def _translate_chunk(backends, chunk: str, index: int, target_language: str, max_retries: int) -> str:
+    """Dịch một khối với backend đầu tiên thành công; raise lỗi của backend cuối nếu tất cả đều lỗi."""
+    error = None
+    for backend in backends:
+        try:
+            if backend == "local":
+                result = await local_translator.translate_chunk(chunk)
+            else:
+                result = await search_agent.translate_chunk(chunk, index, target_language, max_retries)
+        except Exception as e:
+            TRANSLATED_CHUNKS.inc(backend=backend, outcome="error")
+            print(f"Lỗi dịch đoạn {index + 1} bằng backend {backend}: {e}")
+            error = e
+            continue
+        TRANSLATED_CHUNKS.inc(backend=backend, outcome="ok")
+        return result
+    raise error
+
+
+async def iter_translated_chunks(text: str, target_language: str = 'Vietnamese', source_language: str = None,
+                                 max_retries: int = 3):
+    """
+    Chia văn bản theo ranh giới đoạn/câu, dịch các khối đồng thời (tối đa
+    TRANSLATE_CONCURRENCY khối) và trả về dần từng cặp (bản dịch, khoảng trắng gốc
+    sau khối) theo đúng thứ tự, ngay khi khối đó xong. Mỗi khối thử các backend theo
+    route(); raise nếu một khối lỗi ở mọi backend (các khối còn lại bị huỷ).
+    """
+    backends = route(text, target_language, source_language)
+    if not backends:
+        raise RuntimeError("Không có backend dịch khả dụng.")
+
+    # Chia nhỏ văn bản theo đoạn/câu; sep là khoảng trắng gốc sau mỗi khối
+    chunks = chunk_text(text, TRANSLATE_CHUNK_SIZE)
+    semaphore = asyncio.Semaphore(TRANSLATE_CONCURRENCY)
+
+    async def worker(i, chunk):
+        async with semaphore:
+            return await _translate_chunk(backends, chunk, i, target_language, max_retries)
+
+    tasks = [asyncio.ensure_future(worker(i, chunk)) for i, (chunk, _) in enumerate(chunks)]
+    try:
+        for task, (_, sep) in zip(tasks, chunks):
+            yield await task, sep
+    finally:
+        # Một khối lỗi (hoặc người gọi dừng sớm) thì huỷ các khối còn lại
+        for task in tasks:
+            task.cancel()
+
+
+async def translate_text(text: str, target_language: str = 'Vietnamese', source_language: str = None,
+                         max_retries: int = 3) -> str:
+    """
+    Dịch văn bản (xem iter_translated_chunks), ghép các khối lại đúng thứ tự và giữ
+    nguyên các dấu xuống dòng giữa các khối. Lỗi được trả về dạng chuỗi "Lỗi ...".
+    """
+    try:
+        parts = [translated + sep async for translated, sep
+                 in iter_translated_chunks(text, target_language, source_language, max_retries)]
+    except Exception as e:
+        print(f"Lỗi khi dịch: {e}")
+        return f"Lỗi dịch: {e}. Vui lòng thử lại sau."
+
+    return "".join(parts).strip()
+
+
+def shutdown():
+    local_translator.executor.shutdown(wait=False, cancel_futures=True)